@@ -1,109 +1,487 @@
+import functools
+import os
 from collections import defaultdict
-from sqlmodel import Session, case, cast, select, func, Float, text
+from datetime import time
+from sqlalchemy import DateTime, bindparam, literal
+from sqlmodel import Session, case, cast, select, func, Integer
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from models import Application, ApplicationStatusEnum, Position, Stage
+from dotenv import load_dotenv
+from pathlib import Path
 
+from filters import KPIFilter
+from metrics import KPI_STATEMENT_CACHE, instrument_kpi
+from sql_compat import date_bucket, days_between
+from models import Application, ApplicationDailyRollup, ApplicationStatusEnum, HireTimeSketch, Position, Stage, StageDailyRollup
+from sketches import QUANTILES, quantiles, sketch
+
+load_dotenv(dotenv_path=Path(".env"))
+
+# read whole-day aggregates from the rollup tables (see rollups.py) when the filter allows it
+KPI_USE_ROLLUPS = os.getenv("KPI_USE_ROLLUPS", "true").lower() == "true"
+# application_per_job_posting series past the top_positions limit are summed under this title
+OTHER_POSITIONS = "Other"
+
+
+def rollups_cover(filters: KPIFilter, open_end=False):
+    """True when the date bounds fall on day boundaries, so whole rollup days answer the filter.
+    open_end asks for no upper bound at all (time-to-hire also bounds last_updated)."""
+    if not KPI_USE_ROLLUPS:
+        return False
+    start_aligned = filters.start_date is None or filters.start_date.time() == time.min
+    if open_end:
+        return start_aligned and filters.end_date is None
+    return start_aligned and (filters.end_date is None or filters.end_date.time() == time.max)
+
+
+# (builder, filter shape, rollup coverage, extra args) -> statement, see prepared()
+_STATEMENTS = {}
+
+
+def prepared(build):
+    """Builds a KPI statement once per filter shape and hands back the same object after
+    that. Values are bind parameters, so callers execute it with filters.params(); the
+    statement's cache key is then already known to SQLAlchemy's compiled cache, and its SQL
+    text to asyncpg's per-connection prepared statements."""
+    @functools.wraps(build)
+    def cached(filters: KPIFilter, *args):
+        key = (build.__name__, filters.shape(), rollups_cover(filters), rollups_cover(filters, open_end=True), *args)
+        stmt = _STATEMENTS.get(key)
+        if stmt is None:
+            KPI_STATEMENT_CACHE.labels("miss").inc()
+            stmt = _STATEMENTS[key] = build(filters, *args)
+        else:
+            KPI_STATEMENT_CACHE.labels("hit").inc()
+        return stmt
+    return cached
+
+
+def _rollup_filters(model, filters: KPIFilter):
+    return [
+        *filters.where(model.position_id, department_column=model.department),
+        *filters.day_range(model.day),
+    ]
+
+
+def application_status_rollup_stmt(filters):
+    return (
+        select(ApplicationDailyRollup.status, cast(func.sum(ApplicationDailyRollup.application_count), Integer).label("count"))
+        .filter(*_rollup_filters(ApplicationDailyRollup, filters))
+        .group_by(ApplicationDailyRollup.status)
+        # rows decremented to zero stay behind, the raw tables have no row to count
+        .having(func.sum(ApplicationDailyRollup.application_count) > 0)
+    )
+
+
+def candidate_stage_rollup_stmt(filters):
+    return (
+        select(StageDailyRollup.stage_name, cast(func.sum(StageDailyRollup.stage_count), Integer).label("count"))
+        .filter(*_rollup_filters(StageDailyRollup, filters))
+        .group_by(StageDailyRollup.stage_name)
+        .having(func.sum(StageDailyRollup.stage_count) > 0)
+    )
+
+
+def time_to_hire_rollup_stmt(filters):
+    return (
+        select(
+            ApplicationDailyRollup.department,
+            (func.sum(ApplicationDailyRollup.hire_days_sum) / func.sum(ApplicationDailyRollup.application_count)).label("avg_days")
+        )
+        .where(ApplicationDailyRollup.status == ApplicationStatusEnum.ACCEPTED)
+        .filter(*_rollup_filters(ApplicationDailyRollup, filters))
+        .group_by(ApplicationDailyRollup.department)
+        # rows decremented to zero (an acceptance undone) stay behind
+        .having(func.sum(ApplicationDailyRollup.application_count) > 0)
+    )
+
+
+def time_to_hire_sketch_stmt(filters):
+    """Every department's time-to-hire sketch merged over the filter range."""
+    return (
+        select(HireTimeSketch.department, HireTimeSketch.bucket, cast(func.sum(HireTimeSketch.application_count), Integer).label("count"))
+        .filter(*_rollup_filters(HireTimeSketch, filters))
+        .group_by(HireTimeSketch.department, HireTimeSketch.bucket)
+        .having(func.sum(HireTimeSketch.application_count) > 0)
+    )
+
+
+def application_per_job_posting_rollup_stmt(filters):
+    bucket = date_bucket(filters.bucket, ApplicationDailyRollup.day)
+    return (
+        select(
+            Position.title,
+            bucket.label('day'),
+            cast(func.sum(ApplicationDailyRollup.application_count), Integer).label('application_count')
+        )
+        .join(Position, ApplicationDailyRollup.position_id == Position.id)
+        .filter(*_rollup_filters(ApplicationDailyRollup, filters))
+        .group_by(Position.title, bucket)
+        .having(func.sum(ApplicationDailyRollup.application_count) > 0)
+    )
+
+
+def limit_positions(per_bucket, top_positions=bindparam("top_positions", type_=Integer)):
+    """Keeps the top_positions titles with the most applications over the whole range and
+    folds every other title into OTHER_POSITIONS. per_bucket: (title, day, application_count)."""
+    per_bucket = per_bucket.subquery()
+    totals = select(
+        per_bucket,
+        func.sum(per_bucket.c.application_count).over(partition_by=per_bucket.c.title).label("title_total"),
+    ).subquery()
+    ranked = select(
+        totals,
+        func.dense_rank().over(order_by=(totals.c.title_total.desc(), totals.c.title)).label("title_rank"),
+    ).subquery()
+    title = case((ranked.c.title_rank <= top_positions, ranked.c.title), else_=literal(OTHER_POSITIONS))
+    return (
+        select(title.label("title"), ranked.c.day, cast(func.sum(ranked.c.application_count), Integer).label("application_count"))
+        .group_by(title, ranked.c.day)
+    )
+
+
+ALL_POSITIONS = select(Position.title, Position.id)
+
+def all_positions_stmt():
+    return ALL_POSITIONS
+
+@instrument_kpi("all_positions")
 def get_all_positions(db):
-    results = db.exec(select(Position.title, Position.id)).all()
+    results = db.exec(all_positions_stmt()).all()
     return {id: title for title, id in results}
-    
 
-def get_candidate_stage_data(db: Session, filters):
+@instrument_kpi("all_positions")
+async def get_all_positions_async(db: AsyncSession):
+    results = (await db.exec(all_positions_stmt())).all()
+    return {id: title for title, id in results}
 
-    results = db.exec(
-        select(Stage.stage_name, func.count().label("count"))
-        .join(Position, Stage.position_id == Position.id)  # Joining Stage and Position
-        .filter(
-            Position.department.in_(filters["departments"]),
-            Position.id.in_(filters["position_id"]),
-            Stage.conducted_at >= filters["start_date"],
-            Stage.conducted_at <= filters["end_date"]
-        )
+
+@prepared
+def candidate_stage_stmt(filters: KPIFilter):
+    if rollups_cover(filters):
+        return candidate_stage_rollup_stmt(filters)
+    stmt = select(Stage.stage_name, func.count().label("count"))
+    return (
+        filters.join_positions(stmt, Stage.position_id)
+        .filter(*filters.where(Stage.position_id, Stage.conducted_at))
         .group_by(Stage.stage_name)
-    ).all()
+    )
 
+@instrument_kpi("candidate_stage")
+def get_candidate_stage_data(db: Session, filters):
+    results = db.exec(candidate_stage_stmt(filters), params=filters.params()).all()
     return {stage: count for stage, count in results}
 
+@instrument_kpi("candidate_stage")
+async def get_candidate_stage_data_async(db: AsyncSession, filters):
+    results = (await db.exec(candidate_stage_stmt(filters), params=filters.params())).all()
+    return {stage: count for stage, count in results}
 
-def get_time_to_hire_all_depts(db, filters):
-    results = db.exec(
-        select(
-            Position.department,
-            func.avg(
-                cast(
-                    func.extract('epoch', Application.last_updated - Application.applied_at) / 86400,  # Convert seconds to days
-                    Float
-                )
-            ).label("avg_days")
-        )
-        .join(Position, Position.id == Application.position_id)
+
+def _accepted_applications(stmt, filters: KPIFilter):
+    """Accepted applications joined to their position, applied after the start, hired before the end.
+    Hired before the end means applied before it too; saying so lets PostgreSQL prune the
+    applied_at partitions past the end (see partitions.py)."""
+    return (
+        stmt.join(Position, Position.id == Application.position_id)
         .where(Application.status == ApplicationStatusEnum.ACCEPTED)
         .filter(
-            Position.department.in_(filters["departments"]),
-            Position.id.in_(filters["position_id"]),
-            Application.applied_at >= filters["start_date"],
-            Application.last_updated <= filters["end_date"]
+            *filters.where(Application.position_id, Application.applied_at),
+            *filters.date_range(Application.last_updated, lower=False)
         )
-        .group_by(Position.department)
-    ).all()
-    
+    )
+
+@prepared
+def time_to_hire_stmt(filters: KPIFilter):
+    if rollups_cover(filters, open_end=True):
+        return time_to_hire_rollup_stmt(filters)
+    return _accepted_applications(
+        select(
+            Position.department,
+            func.avg(days_between(Application.applied_at, Application.last_updated)).label("avg_days")
+        ),
+        filters,
+    ).group_by(Position.department)
+
+@instrument_kpi("time_to_hire")
+def get_time_to_hire_all_depts(db, filters):
+    results = db.exec(time_to_hire_stmt(filters), params=filters.params()).all()
     return {department: avg_duration for department, avg_duration in results}
 
+@instrument_kpi("time_to_hire")
+async def get_time_to_hire_all_depts_async(db: AsyncSession, filters):
+    results = (await db.exec(time_to_hire_stmt(filters), params=filters.params())).all()
+    return {department: avg_duration for department, avg_duration in results}
 
-def get_application_status_data(db, filters) :
-    results = db.exec (
-        select(Application.status, func.count().label("count"))
-        .join(Position, Application.position_id == Position.id)  # Joining Stage Position
-        .filter(
-            Position.department.in_(filters["departments"]),
-            Position.id.in_(filters["position_id"]),
-            Application.applied_at >= filters["start_date"],
-            Application.applied_at <= filters["end_date"]
-        )
+
+@prepared
+def time_to_hire_percentiles_stmt(filters: KPIFilter, dialect_name: str = "postgresql"):
+    """Merged sketches when the rollups cover the filter. Otherwise an exact percentile_cont
+    on PostgreSQL, or the raw durations to sketch in Python on dialects without it."""
+    if rollups_cover(filters, open_end=True):
+        return time_to_hire_sketch_stmt(filters)
+    days = days_between(Application.applied_at, Application.last_updated)
+    if dialect_name == "postgresql":
+        return _accepted_applications(
+            select(Position.department, *(func.percentile_cont(q).within_group(days).label(name) for name, q in QUANTILES.items())),
+            filters,
+        ).group_by(Position.department)
+    return _accepted_applications(select(Position.department, days.label("days")), filters)
+
+def _time_to_hire_percentiles(filters: KPIFilter, dialect_name: str, results):
+    if rollups_cover(filters, open_end=True):
+        sketches = defaultdict(dict)
+        for department, bucket, count in results:
+            sketches[department][bucket] = count
+        return {department: quantiles(buckets) for department, buckets in sketches.items()}
+    if dialect_name == "postgresql":
+        return {department: dict(zip(QUANTILES, values)) for department, *values in results}
+    durations = defaultdict(list)
+    for department, days in results:
+        durations[department].append(days)
+    return {department: quantiles(sketch(values)) for department, values in durations.items()}
+
+@instrument_kpi("time_to_hire_percentiles")
+def get_time_to_hire_percentiles(db: Session, filters):
+    dialect_name = db.get_bind().dialect.name
+    results = db.exec(time_to_hire_percentiles_stmt(filters, dialect_name), params=filters.params()).all()
+    return _time_to_hire_percentiles(filters, dialect_name, results)
+
+@instrument_kpi("time_to_hire_percentiles")
+async def get_time_to_hire_percentiles_async(db: AsyncSession, filters):
+    dialect_name = db.get_bind().dialect.name
+    results = (await db.exec(time_to_hire_percentiles_stmt(filters, dialect_name), params=filters.params())).all()
+    return _time_to_hire_percentiles(filters, dialect_name, results)
+
+
+@prepared
+def application_status_stmt(filters: KPIFilter):
+    if rollups_cover(filters):
+        return application_status_rollup_stmt(filters)
+    stmt = select(Application.status, func.count().label("count"))
+    return (
+        filters.join_positions(stmt, Application.position_id)
+        .filter(*filters.where(Application.position_id, Application.applied_at))
         .group_by(Application.status)
-    ).all()
-    print(results)
+    )
 
+@instrument_kpi("application_status")
+def get_application_status_data(db, filters) :
+    results = db.exec(application_status_stmt(filters), params=filters.params()).all()
     return {status : count for status, count in results}
 
+@instrument_kpi("application_status")
+async def get_application_status_data_async(db: AsyncSession, filters):
+    results = (await db.exec(application_status_stmt(filters), params=filters.params())).all()
+    return {status : count for status, count in results}
+
+def _recent_applications(filters: KPIFilter):
+    stmt = select(func.count()).select_from(Application)
+    return (
+        filters.join_positions(stmt, Application.position_id)
+        .where(Application.applied_at >= bindparam("recent_since", type_=DateTime))
+        .filter(*filters.where(Application.position_id, Application.applied_at))
+    )
+
+@prepared
+def recent_applications_stmt(filters: KPIFilter):
+    return _recent_applications(filters)
+
+@instrument_kpi("recent_applications")
 def get_recent_applications_count(db: Session, filters):
+    return db.exec(recent_applications_stmt(filters), params=filters.params()).one()
 
-    recent_count = db.exec(
-        select(func.count()).
-        select_from(Application)        
-        .join(Position, Application.position_id == Position.id)  # Joining Stage Position
-        .where(Application.applied_at >= func.now() - text("interval '7 days'"))
-        .filter(
-            Position.department.in_(filters["departments"]),
-            Position.id.in_(filters["position_id"]),
-            Application.applied_at >= filters["start_date"],
-            Application.applied_at <= filters["end_date"]
+@instrument_kpi("recent_applications")
+async def get_recent_applications_count_async(db: AsyncSession, filters):
+    return (await db.exec(recent_applications_stmt(filters), params=filters.params())).one()
+
+
+@prepared
+def application_per_job_posting_stmt(filters: KPIFilter):
+    if rollups_cover(filters):
+        stmt = application_per_job_posting_rollup_stmt(filters)
+    else:
+        bucket = date_bucket(filters.bucket, Application.applied_at)
+        stmt = (
+        select(
+            Position.title,
+            bucket.label('day'),
+            func.count().label('application_count')
+        )
+        .join(Position, Application.position_id == Position.id)
+        .filter(*filters.where(Application.position_id, Application.applied_at))
+        .group_by(Position.title, bucket)
         )
-    ).one()
-    
-    return recent_count
+    if filters.top_positions is not None:
+        # bound at execution through params(), the statement is cached per shape
+        return limit_positions(stmt)
+    return stmt
+
+def _per_posting(results):
+    res = defaultdict(dict)
+    for title, day, count in results:
+        # 'YYYY-MM-DD' of the bucket start; str keys so every cache backend can store it
+        res[title][str(day)] = count
 
+    return res
 
+@instrument_kpi("application_per_job_posting")
 def application_per_job_posting(db: Session, filters) :
-    results = db.exec(
-    select(
-        Position.title,
-        func.to_char(Application.applied_at, 'YYYY-MM-DD').label('day'),  # Correct usage of to_char with the timestamp
-        func.count().label('application_count')
+    return _per_posting(db.exec(application_per_job_posting_stmt(filters), params=filters.params()).all())
+
+@instrument_kpi("application_per_job_posting")
+async def application_per_job_posting_async(db: AsyncSession, filters):
+    return _per_posting((await db.exec(application_per_job_posting_stmt(filters), params=filters.params())).all())
+
+
+#----------------------Changes since a watermark (/dashboard/delta/)-----------------------------
+@prepared
+def changed_positions_stmt(filters: KPIFilter):
+    """Positions (with title and department) that have applications written after :since."""
+    return (
+        select(Position.id, Position.title, Position.department).distinct()
+        .join(Application, Application.position_id == Position.id)
+        .where(Application.last_updated > bindparam("since", type_=DateTime))
+        .filter(*filters.where(Application.position_id, Application.applied_at, upper=False))
     )
-    .join(Position, Application.position_id == Position.id)
-    .filter(
-        Position.department.in_(filters["departments"]),
-        Position.id.in_(filters["position_id"]),
-        Application.applied_at >= filters["start_date"],
-        Application.applied_at <= filters["end_date"]
+
+async def get_changed_positions_async(db: AsyncSession, filters, since):
+    return (await db.exec(changed_positions_stmt(filters), params={**filters.params(), "since": since})).all()
+
+
+@prepared
+def changed_stage_names_stmt(filters: KPIFilter):
+    stmt = select(Stage.stage_name).distinct()
+    return (
+        filters.join_positions(stmt, Stage.position_id)
+        .where(Stage.conducted_at > bindparam("since", type_=DateTime))
+        .filter(*filters.where(Stage.position_id, Stage.conducted_at))
     )
-    .group_by(Position.title, func.to_char(Application.applied_at, 'YYYY-MM-DD'))
-    ).all()
 
-    res = defaultdict(dict)
-    for title, time , count in results:
-        res[title][time] = count
-        
+async def get_changed_stage_names_async(db: AsyncSession, filters, since):
+    return set((await db.exec(changed_stage_names_stmt(filters), params={**filters.params(), "since": since})).all())
 
-    return res
+
+async def get_positions_created_since_async(db: AsyncSession, since):
+    return (await db.exec(select(func.count()).select_from(Position).where(Position.created_at > since))).one()
+
+
+async def get_position_ids_by_title_async(db: AsyncSession, titles):
+    # per_posting is keyed by title, and titles aren't unique
+    return (await db.exec(select(Position.id).where(Position.title.in_(titles)))).all()
+
+
+@prepared
+def dashboard_kpis_stmt(filters: KPIFilter):
+    """Every dashboard KPI as a single statement, aggregated into JSON columns of a single row.
+    KPIs the rollups don't cover share one filtered scan of applications and one of
+    hiring_stages as CTEs."""
+    if not (rollups_cover(filters) and rollups_cover(filters, open_end=True)):
+        apps = (
+            select(Application.status, Application.applied_at, Application.last_updated, Position.title, Position.department)
+            .join(Position, Application.position_id == Position.id)
+            .filter(*filters.where(Application.position_id, Application.applied_at))
+            .cte("apps")
+        )
+    if rollups_cover(filters):
+        status_counts = application_status_rollup_stmt(filters).subquery()
+        stage_counts = candidate_stage_rollup_stmt(filters).subquery()
+    else:
+        status_counts = (
+            select(apps.c.status, func.count().label("count"))
+            .group_by(apps.c.status)
+            .subquery()
+        )
+        stages = (
+            filters.join_positions(select(Stage.stage_name), Stage.position_id)
+            .filter(*filters.where(Stage.position_id, Stage.conducted_at))
+            .cte("stages")
+        )
+        stage_counts = (
+            select(stages.c.stage_name, func.count().label("count"))
+            .group_by(stages.c.stage_name)
+            .subquery()
+        )
+    if rollups_cover(filters, open_end=True):
+        time_to_hire = time_to_hire_rollup_stmt(filters).subquery()
+        sketches = time_to_hire_sketch_stmt(filters).subquery()
+        per_department = (
+            select(sketches.c.department, func.json_object_agg(sketches.c.bucket, sketches.c["count"]).label("sketch"))
+            .group_by(sketches.c.department)
+            .subquery()
+        )
+        time_to_hire_percentiles = select(func.json_object_agg(per_department.c.department, per_department.c.sketch))
+    else:
+        hire_days = days_between(apps.c.applied_at, apps.c.last_updated)
+        accepted = (apps.c.status == ApplicationStatusEnum.ACCEPTED, *filters.date_range(apps.c.last_updated, lower=False))
+        time_to_hire = (
+            select(apps.c.department, func.avg(hire_days).label("avg_days"))
+            .where(*accepted)
+            .group_by(apps.c.department)
+            .subquery()
+        )
+        percentiles = (
+            select(apps.c.department, *(func.percentile_cont(q).within_group(hire_days).label(name) for name, q in QUANTILES.items()))
+            .where(*accepted)
+            .group_by(apps.c.department)
+            .subquery()
+        )
+        time_to_hire_percentiles = select(func.json_object_agg(
+            percentiles.c.department,
+            func.json_build_object(*(part for name in QUANTILES for part in (name, percentiles.c[name]))),
+        ))
+    if rollups_cover(filters):
+        per_day = application_per_job_posting_rollup_stmt(filters)
+    else:
+        bucket = date_bucket(filters.bucket, apps.c.applied_at)
+        per_day = (
+            select(apps.c.title, bucket.label("day"), func.count().label("application_count"))
+            .group_by(apps.c.title, bucket)
+        )
+    if filters.top_positions is not None:
+        per_day = limit_positions(per_day)
+    per_day = per_day.subquery()
+    per_title = (
+        select(per_day.c.title, func.json_object_agg(per_day.c.day, per_day.c.application_count).label("days"))
+        .group_by(per_day.c.title)
+        .subquery()
+    )
+
+    return select(
+        select(func.json_object_agg(Position.id, Position.title)).scalar_subquery().label("all_positions"),
+        select(func.json_object_agg(status_counts.c.status, status_counts.c["count"])).scalar_subquery().label("status_counts"),
+        select(func.json_object_agg(stage_counts.c.stage_name, stage_counts.c["count"])).scalar_subquery().label("stage_counts"),
+        select(func.json_object_agg(time_to_hire.c.department, time_to_hire.c.avg_days)).scalar_subquery().label("time_to_hire"),
+        time_to_hire_percentiles.scalar_subquery().label("time_to_hire_percentiles"),
+        # bounded by its own WHERE rather than counted off apps, so it can use the applied_at
+        # index and partition pruning when the rollups answer everything else
+        _recent_applications(filters).scalar_subquery().label("recent_count"),
+        select(func.json_object_agg(per_title.c.title, per_title.c.days)).scalar_subquery().label("per_posting"),
+    )
+
+def _dashboard_kpis(filters: KPIFilter, row):
+    # json_object_agg over zero rows is NULL
+    time_to_hire_percentiles = row.time_to_hire_percentiles or {}
+    if rollups_cover(filters, open_end=True):
+        # merged sketches, {department: {bucket: count}} with the buckets as JSON strings
+        time_to_hire_percentiles = {
+            department: quantiles({int(bucket): count for bucket, count in buckets.items()})
+            for department, buckets in time_to_hire_percentiles.items()
+        }
+    return {
+        "all_positions": row.all_positions or {},
+        "status_counts": row.status_counts or {},
+        "stage_counts": row.stage_counts or {},
+        "time_to_hire": row.time_to_hire or {},
+        "time_to_hire_percentiles": time_to_hire_percentiles,
+        "recent_count": row.recent_count or 0,
+        "per_posting": row.per_posting or {},
+    }
+
+@instrument_kpi("dashboard_consolidated")
+def get_dashboard_kpis(db: Session, filters):
+    return _dashboard_kpis(filters, db.exec(dashboard_kpis_stmt(filters), params=filters.params()).one())
+
+@instrument_kpi("dashboard_consolidated")
+async def get_dashboard_kpis_async(db: AsyncSession, filters):
+    return _dashboard_kpis(filters, (await db.exec(dashboard_kpis_stmt(filters), params=filters.params())).one())
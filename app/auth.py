@@ -1,5 +1,10 @@
 # Hash Passwords Using Passlib
+import asyncio
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from passlib.context import CryptContext
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -11,6 +16,36 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+# bcrypt is deliberately slow, so keep it off the event loop: it runs on a bounded pool
+# (bcrypt releases the GIL, so threads are enough unless configured otherwise) and
+# callers beyond workers + max pending are turned away instead of queueing forever
+AUTH_HASH_EXECUTOR = os.getenv("AUTH_HASH_EXECUTOR", "thread")
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "4"))
+AUTH_HASH_MAX_PENDING = int(os.getenv("AUTH_HASH_MAX_PENDING", "64"))
+
+class HashingOverloaded(Exception):
+    pass
+
+_hash_pool = (ProcessPoolExecutor if AUTH_HASH_EXECUTOR == "process" else ThreadPoolExecutor)(max_workers=AUTH_HASH_WORKERS)
+_hash_in_flight = 0
+
+async def _offload(fn, *args):
+    global _hash_in_flight
+    if _hash_in_flight >= AUTH_HASH_WORKERS + AUTH_HASH_MAX_PENDING:
+        raise HashingOverloaded()
+    _hash_in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_pool, fn, *args)
+    finally:
+        _hash_in_flight -= 1
+
+async def hash_password_async(password: str) -> str:
+    return await _offload(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _offload(verify_password, plain_password, hashed_password)
+
+
 #Configure JWT Authentication
 import jwt
 from datetime import datetime, timedelta
@@ -30,9 +65,40 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+# verified payloads by token, so repeat requests with the same bearer token skip the crypto;
+# an entry is only served until the token's own exp
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+def _cached_payload(token: str):
+    with _token_cache_lock:
+        entry = _token_cache.get(token)
+        if entry is None:
+            return None
+        payload, expires_at = entry
+        # exp is seconds since the epoch; utcnow().timestamp() would read UTC as local time
+        if expires_at <= time.time():
+            del _token_cache[token]
+            return None
+        _token_cache.move_to_end(token)
+        return payload
+
+def _cache_payload(token: str, payload: dict):
+    if "exp" not in payload:
+        return
+    with _token_cache_lock:
+        _token_cache[token] = (payload, payload["exp"])
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+
 def verify_access_token(token: str):
+    payload = _cached_payload(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        _cache_payload(token, payload)
         return payload
     except jwt.ExpiredSignatureError:
         return None
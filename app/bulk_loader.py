@@ -0,0 +1,173 @@
+"""Streaming bulk loader for users / positions / applications / hiring_stages.
+
+Reads NDJSON (.ndjson/.jsonl) or CSV line by line and writes it in fixed-size chunks:
+PostgreSQL COPY on PostgreSQL, multi-row executemany on anything else. Memory stays
+flat whatever the file size. Legacy JSON array files (.json, as written by
+mock_generator) are accepted too, but those are read whole.
+
+    python bulk_loader.py applications applications.ndjson --chunk-size 50000 --rebuild-indexes
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime
+from enum import Enum as PyEnum
+from itertools import islice
+
+from dotenv import load_dotenv
+from pathlib import Path
+from loguru import logger as log
+from sqlalchemy import DateTime, Enum, Integer, text
+from sqlmodel import Session
+
+from db_utils import create_db_engine
+
+from cache import kpi_cache
+from models import Application, Position, Stage, User
+from rollups import rebuild_rollups
+from watermarks import bump_ingest_watermark
+
+load_dotenv(dotenv_path=Path(".env"))
+
+BULK_LOAD_CHUNK_SIZE = int(os.getenv("BULK_LOAD_CHUNK_SIZE", "10000"))
+
+MODELS = {
+    "users": User,
+    "positions": Position,
+    "applications": Application,
+    "hiring_stages": Stage,
+}
+# rollups are derived from these, see rollups.py
+ROLLUP_SOURCES = {"applications", "hiring_stages"}
+
+
+def read_rows(path: str):
+    suffix = Path(path).suffix.lower()
+    with open(path, "r", newline="") as file:
+        if suffix in (".ndjson", ".jsonl"):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        elif suffix == ".csv":
+            yield from csv.DictReader(file)
+        else:
+            yield from json.load(file)
+
+
+def _coercer(column):
+    if isinstance(column.type, Enum) and column.type.enum_class is not None:
+        enum_class = column.type.enum_class
+
+        def coerce_enum(value):
+            # "ACCEPTED" or "ApplicationStatusEnum.ACCEPTED" -> the label stored in the database
+            if isinstance(value, PyEnum):
+                return value.name
+            return enum_class(str(value).rsplit(".", 1)[-1]).name
+        return coerce_enum
+    if isinstance(column.type, DateTime):
+        return lambda value: value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    if isinstance(column.type, Integer):
+        return int
+    return lambda value: value
+
+
+def coerce_rows(table, rows):
+    """Maps raw dicts onto the table's columns, coercing enums, dates and ints. Empty -> NULL."""
+    coercers = {column.name: _coercer(column) for column in table.columns}
+    for row in rows:
+        yield {
+            name: None if row.get(name) in (None, "") else coerce(row[name])
+            for name, coerce in coercers.items()
+            if name in row
+        }
+
+
+def chunked(rows, size: int):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def _copy_chunk(connection, table, columns, chunk):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in chunk:
+        writer.writerow([
+            value.isoformat() if isinstance(value, datetime) else value
+            for value in (row.get(name) for name in columns)
+        ])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _insert_chunk(connection, table, columns, chunk):
+    connection.execute(table.insert(), [{name: row.get(name) for name in columns} for row in chunk])
+
+
+def _reset_sequences(connection, table):
+    # COPY with explicit ids leaves serial sequences behind, and the next ORM insert collides
+    primary_key = list(table.primary_key.columns)
+    for column in primary_key:
+        if len(primary_key) == 1 and isinstance(column.type, Integer):
+            connection.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', '{column.name}'), "
+                f"COALESCE((SELECT max({column.name}) FROM {table.name}), 0) + 1, false)"
+            ))
+
+
+def load_file(engine, table_name: str, path: str, chunk_size: int = BULK_LOAD_CHUNK_SIZE, rebuild_indexes: bool = False, update_rollups: bool = True):
+    table = MODELS[table_name].__table__
+    use_copy = engine.dialect.name == "postgresql"
+    loaded, started = 0, time.perf_counter()
+
+    with engine.begin() as connection:
+        if rebuild_indexes:
+            for index in table.indexes:
+                index.drop(connection, checkfirst=True)
+
+        columns = None
+        for chunk in chunked(coerce_rows(table, read_rows(path)), chunk_size):
+            columns = columns or [name for name in table.columns.keys() if name in chunk[0]]
+            if use_copy:
+                _copy_chunk(connection, table, columns, chunk)
+            else:
+                _insert_chunk(connection, table, columns, chunk)
+            loaded += len(chunk)
+            elapsed = time.perf_counter() - started
+            log.debug(f"{table_name}: {loaded} rows ({loaded / elapsed:.0f} rows/s)")
+
+        if rebuild_indexes:
+            for index in table.indexes:
+                index.create(connection)
+        if use_copy:
+            _reset_sequences(connection, table)
+        # loaded rows carry their own timestamps, so delta clients have to start over
+        bump_ingest_watermark(connection)
+
+    elapsed = time.perf_counter() - started
+    stats = {"table": table_name, "rows": loaded, "seconds": round(elapsed, 3), "rows_per_sec": round(loaded / elapsed) if elapsed else loaded}
+    log.info(stats)
+
+    # bulk writes bypass the ORM events that normally keep these in step
+    if update_rollups and table_name in ROLLUP_SOURCES:
+        with Session(engine) as db:
+            rebuild_rollups(db)
+    kpi_cache.invalidate()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream a NDJSON/CSV file into a table")
+    parser.add_argument("table", choices=MODELS.keys())
+    parser.add_argument("path")
+    parser.add_argument("--chunk-size", type=int, default=BULK_LOAD_CHUNK_SIZE)
+    parser.add_argument("--rebuild-indexes", action="store_true", help="drop the table's indexes for the load and recreate them after")
+    parser.add_argument("--skip-rollups", action="store_true", help="don't rebuild the daily rollups afterwards")
+    args = parser.parse_args()
+
+    engine = create_db_engine(os.getenv("DATABASE_URL"), name="bulk_loader")
+    load_file(engine, args.table, args.path, args.chunk_size, args.rebuild_indexes, not args.skip_rollups)
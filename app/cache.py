@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import json
+
+import orjson
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from dotenv import load_dotenv
+from pathlib import Path
+from loguru import logger as log
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from metrics import KPI_COALESCE_TIMEOUTS, KPI_COALESCED
+from models import Application, Position, Stage
+from responses import dumps
+
+load_dotenv(dotenv_path=Path(".env"))
+
+KPI_CACHE_BACKEND = os.getenv("KPI_CACHE_BACKEND", "memory")
+KPI_CACHE_TTL_SECONDS = float(os.getenv("KPI_CACHE_TTL_SECONDS", "60"))
+KPI_CACHE_MAX_ENTRIES = int(os.getenv("KPI_CACHE_MAX_ENTRIES", "1024"))
+KPI_CACHE_REDIS_URL = os.getenv("KPI_CACHE_REDIS_URL", "redis://localhost:6379/0")
+# how long a request waits on an identical one already computing before giving up
+KPI_COALESCE_WAIT_SECONDS = float(os.getenv("KPI_COALESCE_WAIT_SECONDS", "10"))
+
+# rows of these tables feed the dashboard KPIs
+WATCHED_MODELS = (Application, Stage, Position)
+
+
+def make_filter_key(filters: dict) -> str:
+    """Stable key for a dashboard filter dict; unset and empty dimensions are treated alike."""
+    def _date(value):
+        return value.isoformat() if isinstance(value, datetime) else value
+
+    normalized = {
+        "position_id": sorted(set(filters.get("position_id") or [])),
+        "departments": sorted(set(filters.get("departments") or [])),
+        "start_date": _date(filters.get("start_date")),
+        "end_date": _date(filters.get("end_date")),
+        "bucket": filters.get("bucket"),
+        "top_positions": filters.get("top_positions"),
+    }
+    raw = json.dumps(normalized, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+#----------------------Backends-----------------------------
+class MemoryBackend:
+    """Per-process LRU with TTL. Entries written under an older generation are dropped.
+
+    get / set / version are coroutines to match RedisBackend; generation() and clear() stay
+    plain calls for the sync write paths (ORM commit hooks, bulk_loader, rollup rebuilds)."""
+
+    def __init__(self, max_entries: int = KPI_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        # generations restart at 0 in every process, so versions carry a per-process id
+        self._instance = os.urandom(4).hex()
+
+    def generation(self) -> int:
+        return self._generation
+
+    async def version(self) -> str:
+        return f"{self._instance}.{self._generation}"
+
+    async def get(self, key: str):
+        """(value or None, the generation it was looked up under)."""
+        with self._lock:
+            generation = self._generation
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, generation
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None, generation
+            self._entries.move_to_end(key)
+            return value, generation
+
+    async def set(self, key: str, value, ttl: float, generation: int):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+class RedisBackend:
+    """Shared across workers; size is bounded by the server's maxmemory-policy. Clearing is a
+    single INCR of a generation counter, and each entry carries the generation it was
+    computed under, so a lookup reads the counter and the entry in one MGET.
+
+    Lookups go through redis.asyncio so they don't block the event loop; clear() uses the
+    blocking client, as it's called from the sync write paths."""
+
+    def __init__(self, url: str = KPI_CACHE_REDIS_URL, prefix: str = "kpi"):
+        import redis  # only needed when this backend is selected
+        import redis.asyncio
+
+        self.client = redis.Redis.from_url(url)
+        self.async_client = redis.asyncio.Redis.from_url(url)
+        self.prefix = prefix
+        self.generation_key = f"{prefix}:generation"
+
+    def generation(self) -> int:
+        return int(self.client.get(self.generation_key) or 0)
+
+    async def version(self) -> str:
+        return str(int(await self.async_client.get(self.generation_key) or 0))
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}:entry:{key}"
+
+    async def get(self, key: str):
+        raw_generation, raw = await self.async_client.mget(self.generation_key, self._key(key))
+        generation = int(raw_generation or 0)
+        if raw is None:
+            return None, generation
+        entry = orjson.loads(raw)
+        if entry["generation"] != generation:
+            return None, generation
+        return entry["value"], generation
+
+    async def set(self, key: str, value, ttl: float, generation: int):
+        # not checked against the current generation (that's another round trip): an entry
+        # computed before an invalidation is just ignored by get() and computed again.
+        # Encoded as responses encodes it, so a value read back re-encodes to the same bytes.
+        entry = {"generation": generation, "value": value}
+        await self.async_client.set(self._key(key), dumps(entry), px=int(ttl * 1000))
+
+    def clear(self):
+        self.client.incr(self.generation_key)
+
+
+BACKENDS = {
+    "memory": MemoryBackend,
+    "redis": RedisBackend,
+}
+
+
+#----------------------Single flight-----------------------------
+class CoalesceTimeout(Exception):
+    """An identical computation is in flight but didn't finish within the wait."""
+
+
+class SingleFlight:
+    """Concurrent callers with the same key share one in-flight computation (per process)."""
+
+    def __init__(self, max_wait: float = KPI_COALESCE_WAIT_SECONDS):
+        self.max_wait = max_wait
+        self._flights = {}
+
+    def _land(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.cancelled():
+            flight.exception()  # retrieved, so an error nobody waited for isn't logged as lost
+
+    async def run(self, key, compute):
+        flight = self._flights.get(key)
+        if flight is not None:
+            KPI_COALESCED.inc()
+            try:
+                return await asyncio.wait_for(asyncio.shield(flight), self.max_wait)
+            except asyncio.TimeoutError:
+                KPI_COALESCE_TIMEOUTS.inc()
+                raise CoalesceTimeout(f"Waited {self.max_wait:g}s on an identical request") from None
+
+        flight = asyncio.ensure_future(compute())
+        self._flights[key] = flight
+        flight.add_done_callback(lambda done: self._land(key, done))
+        # shielded: the first caller going away (client disconnect) mustn't cancel the others' result
+        return await asyncio.shield(flight)
+
+
+#----------------------Cache-----------------------------
+class KPICache:
+    def __init__(self, backend, ttl: float = KPI_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.flights = SingleFlight()
+        # called after every invalidation, see live.py
+        self.listeners = []
+
+    @property
+    def generation(self) -> int:
+        return self.backend.generation()
+
+    async def version(self) -> str:
+        """Changes whenever the cache is invalidated."""
+        return await self.backend.version()
+
+    async def get_or_compute_async(self, filters: dict, compute):
+        """The cached value, else await compute() and store it; concurrent misses on the same
+        key and generation are computed once."""
+        key = make_filter_key(filters)
+        # remember the generation we computed under so a write landing mid-compute
+        # doesn't leave a stale entry behind
+        value, generation = await self.backend.get(key)
+        if value is not None:
+            return value
+
+        async def compute_and_store():
+            value = await compute()
+            await self.backend.set(key, value, self.ttl, generation)
+            return value
+
+        # a request arriving after an invalidation doesn't join a flight started before it
+        return await self.flights.run((key, generation), compute_and_store)
+
+    def invalidate(self):
+        log.debug("Invalidating KPI cache")
+        self.backend.clear()
+        for listener in self.listeners:
+            listener()
+
+
+kpi_cache = KPICache(BACKENDS[KPI_CACHE_BACKEND]())
+
+
+#----------------------Write-driven invalidation-----------------------------
+@event.listens_for(Session, "after_flush")
+def _mark_kpi_tables_dirty(session, flush_context):
+    changed = (*session.new, *session.dirty, *session.deleted)
+    if any(isinstance(obj, WATCHED_MODELS) for obj in changed):
+        session.info["kpi_dirty"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop("kpi_dirty", False):
+        kpi_cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_on_rollback(session):
+    session.info.pop("kpi_dirty", None)
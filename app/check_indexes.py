@@ -0,0 +1,84 @@
+"""EXPLAINs every KPIs.py query against a seeded PostgreSQL database and fails if any of
+them reads applications / hiring_stages / positions with a sequential scan.
+
+Seed first (mock_generator.py + mock_inserter.py), then run migrations.py, then:
+
+    python check_indexes.py
+"""
+import json
+import os
+import sys
+from datetime import timedelta
+
+from dotenv import load_dotenv
+from pathlib import Path
+from loguru import logger as log
+from sqlalchemy import func, select, text
+from sqlmodel import Session
+
+from db_utils import create_db_engine
+
+import KPIs
+from filters import KPIFilter
+from models import Application, DepartmentEnum, Position
+
+load_dotenv(dotenv_path=Path(".env"))
+
+KPI_STATEMENTS = {
+    "get_candidate_stage_data": KPIs.candidate_stage_stmt,
+    "get_time_to_hire_all_depts": KPIs.time_to_hire_stmt,
+    "get_time_to_hire_percentiles": KPIs.time_to_hire_percentiles_stmt,
+    "get_application_status_data": KPIs.application_status_stmt,
+    "get_recent_applications_count": KPIs.recent_applications_stmt,
+    "application_per_job_posting": KPIs.application_per_job_posting_stmt,
+}
+INDEXED_TABLES = {"applications", "hiring_stages", "positions"}
+
+
+def sample_filters(db: Session):
+    """A selective dashboard filter: a handful of positions over the last 30 days of data."""
+    position_ids = db.exec(select(Position.id).order_by(Position.id).limit(5)).all()
+    latest = db.exec(select(func.max(Application.applied_at))).one()
+    return KPIFilter(
+        position_ids=tuple(position_ids),
+        departments=tuple(department.value for department in DepartmentEnum),
+        start_date=latest - timedelta(days=30, seconds=1),  # deliberately off a day boundary: raw tables, not rollups
+        end_date=latest,
+        array_binds=db.get_bind().dialect.name == "postgresql",
+    )
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def sequential_scans(db: Session, stmt):
+    sql = str(stmt.compile(dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True}))
+    plan = db.exec(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return [
+        node["Relation Name"] for node in _plan_nodes(plan[0]["Plan"])
+        if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in INDEXED_TABLES
+    ]
+
+
+def check_kpi_indexes(db: Session):
+    filters = sample_filters(db)
+    failures = {}
+    for name, build in KPI_STATEMENTS.items():
+        scans = sequential_scans(db, build(filters).params(filters.params()))
+        if scans:
+            failures[name] = scans
+            log.error(f"{name}: sequential scan on {', '.join(scans)}")
+        else:
+            log.success(f"{name}: index scans only")
+    return failures
+
+
+if __name__ == "__main__":
+    engine = create_db_engine(os.getenv("DATABASE_URL"), name="check_indexes")
+    with Session(engine) as db:
+        sys.exit(1 if check_kpi_indexes(db) else 0)
@@ -0,0 +1,91 @@
+"""Runs a spread of dashboard filters through the SQL KPIs and through a snapshot loaded from
+the same database, and fails if any KPI differs. Counts must match exactly, averages to
+float rounding.
+
+Time-to-hire percentiles always come from sketches on the snapshot; PostgreSQL computes
+exact ones with percentile_cont when the rollups don't cover the filter, so those are skipped.
+test_snapshot.py runs the same filters over a small generated dataset.
+
+    python check_snapshot_parity.py
+"""
+import math
+import os
+import sys
+from datetime import datetime, time, timedelta
+
+from dotenv import load_dotenv
+from pathlib import Path
+from loguru import logger as log
+from sqlmodel import Session, func, select
+
+from db_utils import create_db_engine
+
+from dashboard import get_kpis_per_query
+from filters import KPIFilter
+from KPIs import rollups_cover
+from models import Application, DepartmentEnum, Position
+from snapshot import load_snapshot
+
+load_dotenv(dotenv_path=Path(".env"))
+
+
+def sample_filters(db: Session):
+    position_ids = tuple(db.exec(select(Position.id).order_by(Position.id).limit(5)).all())
+    latest = db.exec(select(func.max(Application.applied_at))).one() or datetime.utcnow()
+    day_start = datetime.combine(latest.date() - timedelta(days=30), time.min)
+    day_end = datetime.combine(latest.date(), time.max)
+    departments = tuple(department.value for department in list(DepartmentEnum)[:2])
+    return {
+        "everything": {},
+        "departments": {"departments": departments},
+        "positions": {"position_id": position_ids},
+        "whole days (rollups)": {"start_date": day_start, "end_date": day_end, "bucket": "day"},
+        "part days (raw tables)": {"start_date": day_start + timedelta(hours=5), "end_date": latest, "bucket": "week"},
+        "open end": {"start_date": day_start - timedelta(days=335), "bucket": "month"},
+        "top positions": {"departments": departments, "top_positions": 2},
+        "all dimensions": {"position_id": position_ids, "departments": departments, "start_date": day_start + timedelta(minutes=1), "end_date": latest},
+    }
+
+
+def _same(sql, snapshot) -> bool:
+    if isinstance(sql, dict) and isinstance(snapshot, dict):
+        sql, snapshot = ({str(key): value for key, value in side.items()} for side in (sql, snapshot))
+        return sql.keys() == snapshot.keys() and all(_same(sql[key], snapshot[key]) for key in sql)
+    if isinstance(sql, float) or isinstance(snapshot, float):
+        return sql is not None and snapshot is not None and math.isclose(float(sql), float(snapshot), rel_tol=1e-9, abs_tol=1e-9)
+    return sql == snapshot
+
+
+def mismatches(db: Session, snapshot, raw: dict) -> list:
+    """KPIs on which SQL and the snapshot disagree for these dashboard filters."""
+    dialect_name = db.get_bind().dialect.name
+    filters = KPIFilter.from_dict(raw, dialect_name)
+    sql_kpis = get_kpis_per_query(db, filters)
+    snapshot_kpis = snapshot.kpis(filters)
+    failed = []
+    for kpi, value in sql_kpis.items():
+        if kpi == "time_to_hire_percentiles" and dialect_name == "postgresql" and not rollups_cover(filters, open_end=True):
+            continue
+        if not _same(value, snapshot_kpis[kpi]):
+            failed.append(kpi)
+            log.error(f"{kpi}: sql {value} != snapshot {snapshot_kpis[kpi]}")
+    return failed
+
+
+def check_snapshot_parity(db: Session):
+    snapshot = load_snapshot(db)
+    failures = []
+    for name, raw in sample_filters(db).items():
+        failed = mismatches(db, snapshot, raw)
+        failures.extend((name, kpi) for kpi in failed)
+        if failed:
+            log.error(f"{name}: {', '.join(failed)} differ")
+        else:
+            log.success(f"{name}: every KPI matches")
+    return failures
+
+
+if __name__ == "__main__":
+    engine = create_db_engine(os.getenv("DATABASE_URL"), name="check_snapshot_parity")
+    with Session(engine) as db:
+        sys.exit(1 if check_snapshot_parity(db) else 0)
@@ -0,0 +1,198 @@
+import asyncio
+import os
+from dataclasses import replace
+from datetime import datetime
+
+from dotenv import load_dotenv
+from pathlib import Path
+from sqlmodel import Session
+
+from KPIs import (
+    OTHER_POSITIONS, application_per_job_posting, application_per_job_posting_async, get_all_positions, get_all_positions_async,
+    get_application_status_data, get_application_status_data_async, get_candidate_stage_data,
+    get_candidate_stage_data_async, get_changed_positions_async, get_changed_stage_names_async, get_dashboard_kpis,
+    get_dashboard_kpis_async, get_position_ids_by_title_async, get_positions_created_since_async,
+    get_recent_applications_count, get_recent_applications_count_async, get_time_to_hire_all_depts,
+    get_time_to_hire_all_depts_async, get_time_to_hire_percentiles, get_time_to_hire_percentiles_async,
+)
+from filters import KPIFilter
+from models import DepartmentEnum, HiringStageNameEnum
+
+load_dotenv(dotenv_path=Path(".env"))
+
+# "consolidated" fetches every KPI in one statement (PostgreSQL only), "per_kpi" runs one query per KPI
+DASHBOARD_QUERY_MODE = os.getenv("DASHBOARD_QUERY_MODE", "consolidated")
+
+
+def use_consolidated_query(dialect_name: str) -> bool:
+    return DASHBOARD_QUERY_MODE == "consolidated" and dialect_name == "postgresql"
+
+
+def get_kpis_per_query(db: Session, filters: KPIFilter):
+    return {
+        "all_positions": get_all_positions(db),
+        "status_counts": get_application_status_data(db, filters),
+        "stage_counts": get_candidate_stage_data(db, filters),
+        "time_to_hire": get_time_to_hire_all_depts(db, filters),
+        "time_to_hire_percentiles": get_time_to_hire_percentiles(db, filters),
+        "recent_count": get_recent_applications_count(db, filters),
+        "per_posting": application_per_job_posting(db, filters),
+    }
+
+
+async def gather_kpis(session_factory, runs: dict):
+    """Runs each KPI on its own session, and so its own pooled connection, all at once.
+    runs maps a kpis key to (kpi function, filters)."""
+    async def run(kpi, filters):
+        async with session_factory() as db:
+            return await kpi(db, filters)
+
+    results = await asyncio.gather(*(run(kpi, filters) for kpi, filters in runs.values()))
+    return dict(zip(runs, results))
+
+
+async def get_kpis_concurrently(session_factory, filters: KPIFilter):
+    return await gather_kpis(session_factory, {
+        "all_positions": (lambda db, _: get_all_positions_async(db), filters),
+        "status_counts": (get_application_status_data_async, filters),
+        "stage_counts": (get_candidate_stage_data_async, filters),
+        "time_to_hire": (get_time_to_hire_all_depts_async, filters),
+        "time_to_hire_percentiles": (get_time_to_hire_percentiles_async, filters),
+        "recent_count": (get_recent_applications_count_async, filters),
+        "per_posting": (application_per_job_posting_async, filters),
+    })
+
+
+def _total_applications(status_counts: dict, stage_counts: dict):
+    return stage_counts.get("RESUME_SCREENING", 0) + status_counts.get("APPLIED", 0)
+
+
+def _offer_status(status_counts: dict):
+    return {"OFFER_ACCEPTED" : status_counts.get("ACCEPTED",0), "OFFER_DECLINED": status_counts.get("DECLINED",0), "OFFER_PENDING": status_counts.get("OFFERED",0)}
+
+
+def _application_status_count(status_counts: dict):
+    return {"WAITING": status_counts.get("IN_PROGRESS",0), "NO_ACTION": status_counts.get("APPLIED",0)}
+
+
+def shape_dashboard(kpis: dict):
+    all_application_status = kpis["status_counts"]
+    stage_counts = kpis["stage_counts"]
+
+    return {
+        'all_positions': kpis["all_positions"],
+        'all_departments' : [department.value for department in DepartmentEnum],
+        'candidate_stage_counts': {
+            "TOTAL_APPLICATIONS": _total_applications(all_application_status, stage_counts),
+            **stage_counts
+        },
+        'depts_time_to_hire': kpis["time_to_hire"],
+        'depts_time_to_hire_percentiles': kpis["time_to_hire_percentiles"],
+        'offer_status': _offer_status(all_application_status),
+        'application_status_count' : {**_application_status_count(all_application_status), "NEW_APPLICANTS": kpis["recent_count"]},
+        'application_per_job_posting': kpis["per_posting"],
+    }
+
+
+def build_dashboard(db: Session, filters: dict):
+    dialect_name = db.get_bind().dialect.name
+    filters = KPIFilter.from_dict(filters, dialect_name)
+
+    if use_consolidated_query(dialect_name):
+        kpis = get_dashboard_kpis(db, filters)
+    else:
+        kpis = get_kpis_per_query(db, filters)
+
+    return shape_dashboard(kpis)
+
+
+async def build_dashboard_async(session_factory, dialect_name: str, filters: dict):
+    filters = KPIFilter.from_dict(filters, dialect_name)
+
+    if use_consolidated_query(dialect_name):
+        async with session_factory() as db:
+            kpis = await get_dashboard_kpis_async(db, filters)
+    else:
+        kpis = await get_kpis_concurrently(session_factory, filters)
+
+    return shape_dashboard(kpis)
+
+
+def build_dashboard_from_snapshot(snapshot, filters: dict):
+    """The dashboard from an in-memory snapshot.Snapshot rather than SQL."""
+    return shape_dashboard(snapshot.kpis(KPIFilter.from_dict(filters, dialect_name="snapshot")))
+
+
+#----------------------Delta-----------------------------
+def _narrow(current, changed):
+    """A filter dimension cut down to the changed values it allows."""
+    changed = set(changed)
+    return tuple(sorted(changed if current is None else changed.intersection(current)))
+
+
+async def get_kpis_changed_since(session_factory, filters: KPIFilter, since: datetime):
+    """Recomputes only the KPIs, and for per-position / per-department ones only the entries,
+    that rows written after since can have moved. Returns (kpis, titles whose per-posting
+    series can have moved, changed departments)."""
+    async with session_factory() as db:
+        changed_positions = await get_changed_positions_async(db, filters, since)
+        stage_names = await get_changed_stage_names_async(db, filters, since)
+        new_positions = await get_positions_created_since_async(db, since)
+        position_ids = await get_position_ids_by_title_async(db, {title for _, title, _ in changed_positions}) if changed_positions else []
+    departments = _narrow(filters.departments, (department.value for _, _, department in changed_positions))
+
+    # the 7 day window moves on its own, so NEW_APPLICANTS is always sent
+    runs = {"recent_count": (get_recent_applications_count_async, filters)}
+    if new_positions:
+        runs["all_positions"] = (lambda db, _: get_all_positions_async(db), filters)
+    if changed_positions or stage_names:
+        # an application's previous status is gone, so its counts can't be patched, only recounted
+        runs["status_counts"] = (get_application_status_data_async, filters)
+        runs["stage_counts"] = (get_candidate_stage_data_async, filters)
+    if changed_positions:
+        runs["time_to_hire"] = (get_time_to_hire_all_depts_async, replace(filters, departments=departments))
+        runs["time_to_hire_percentiles"] = (get_time_to_hire_percentiles_async, replace(filters, departments=departments))
+        if filters.top_positions is not None:
+            # with a top-N limit any change can reorder the ranking, and so push any title
+            # into or out of OTHER_POSITIONS: every title is sent
+            runs["all_positions"] = (lambda db, _: get_all_positions_async(db), filters)
+            runs["per_posting"] = (application_per_job_posting_async, filters)
+        else:
+            runs["per_posting"] = (application_per_job_posting_async, replace(filters, position_ids=_narrow(filters.position_ids, position_ids)))
+
+    kpis = await gather_kpis(session_factory, runs)
+    titles = {title for _, title, _ in changed_positions}
+    if filters.top_positions is not None and "per_posting" in kpis:
+        titles = {*kpis["all_positions"].values(), OTHER_POSITIONS}
+    return kpis, titles, departments
+
+
+def shape_dashboard_delta(kpis: dict, titles: set, departments: tuple):
+    """The sections of shape_dashboard that kpis covers, each holding only its changed entries.
+    Clients merge every section into their copy key by key; a None value removes the key, so
+    every key that shape_dashboard would now leave out is sent as None."""
+    delta = {'application_status_count': {"NEW_APPLICANTS": kpis["recent_count"]}}
+    if "all_positions" in kpis:
+        delta['all_positions'] = kpis["all_positions"]
+    if "status_counts" in kpis:
+        status_counts, stage_counts = kpis["status_counts"], kpis["stage_counts"]
+        delta['candidate_stage_counts'] = {
+            "TOTAL_APPLICATIONS": _total_applications(status_counts, stage_counts),
+            # every stage: one whose rows were renamed away has no row written after since
+            **{name.value: stage_counts.get(name) for name in HiringStageNameEnum},
+        }
+        delta['offer_status'] = _offer_status(status_counts)
+        delta['application_status_count'].update(_application_status_count(status_counts))
+    if "time_to_hire" in kpis:
+        delta['depts_time_to_hire'] = {department: kpis["time_to_hire"].get(department) for department in departments}
+        delta['depts_time_to_hire_percentiles'] = {department: kpis["time_to_hire_percentiles"].get(department) for department in departments}
+    if "per_posting" in kpis:
+        per_posting = kpis["per_posting"]
+        delta['application_per_job_posting'] = {title: per_posting.get(title) for title in titles | per_posting.keys()}
+    return delta
+
+
+async def build_dashboard_delta_async(session_factory, dialect_name: str, filters: dict, since: datetime):
+    filters = KPIFilter.from_dict(filters, dialect_name)
+    kpis, titles, departments = await get_kpis_changed_since(session_factory, filters, since)
+    return shape_dashboard_delta(kpis, titles, departments)
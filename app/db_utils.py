@@ -1,6 +1,17 @@
-from sqlalchemy import text
+import asyncio
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from pathlib import Path
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlmodel import Session
-from sqlalchemy.exc import SQLAlchemyError
+
+load_dotenv(dotenv_path=Path(".env"))
 
 def check_db_connection(db: Session):
     try:
@@ -13,3 +24,164 @@ def check_db_connection(db: Session):
         db.close()
         
         
+        
+# sync driver -> asyncio driver for the same database
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def to_async_url(database_url: str) -> str:
+    scheme, rest = database_url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+
+#----------------------Engine factory-----------------------------
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))  # 0 = no limit
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+# compiled statements SQLAlchemy keeps per engine, and prepared statements asyncpg keeps per connection
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "500"))
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "500"))
+
+
+class PoolStats:
+    """Cumulative checkout counters for one named pool; live gauges come from the pool itself."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, waited: float, timed_out: bool):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+
+# pool logging name -> stats; the name survives pool.recreate(), the pool object doesn't
+POOL_STATS = {}
+ENGINES = {}
+
+
+class _InstrumentedPool:
+    def connect(self):
+        stats = POOL_STATS.get(self._orig_logging_name)
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            timed_out = True
+            raise
+        finally:
+            if stats is not None:
+                stats.record(time.perf_counter() - started, timed_out)
+
+
+class InstrumentedQueuePool(_InstrumentedPool, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def _engine_options(url: str, name: str, is_async: bool):
+    options = {"echo": DB_ECHO, "pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE, "query_cache_size": DB_QUERY_CACHE_SIZE}
+    if url.startswith("sqlite"):
+        # SQLAlchemy's own choice (NullPool for aiosqlite, whose worker threads would otherwise block exit)
+        return options
+
+    options.update(
+        poolclass=InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_logging_name=name,
+    )
+    if DB_STATEMENT_TIMEOUT_MS and url.startswith("postgresql"):
+        if is_async:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+def create_db_engine(url: str, name: str = "primary", **overrides):
+    """Engine with pool settings from the DB_* environment variables and checkout stats under name."""
+    engine = create_engine(url, **{**_engine_options(url, name, is_async=False), **overrides})
+    POOL_STATS.setdefault(name, PoolStats(name))
+    ENGINES[name] = engine
+    return engine
+
+
+def create_async_db_engine(url: str, name: str = "primary_async", **overrides):
+    if url.startswith("postgresql+asyncpg") and "prepared_statement_cache_size" not in url:
+        # asyncpg prepares every statement; the KPI statements' SQL is stable per filter shape, so they're reused
+        url = make_url(url).update_query_dict({"prepared_statement_cache_size": str(DB_PREPARED_STATEMENT_CACHE_SIZE)})
+    engine = create_async_engine(url, **{**_engine_options(str(url), name, is_async=True), **overrides})
+    POOL_STATS.setdefault(name, PoolStats(name))
+    ENGINES[name] = engine
+    return engine
+
+
+def _warm_size(engine) -> int:
+    # the connections the pool keeps open; 1 for SQLite's pools, which keep none or one
+    pool = engine.pool
+    return pool.size() if isinstance(pool, QueuePool) else 1
+
+
+def warm_pool(engine):
+    """Opens the pool's pool_size connections up front, so early requests don't pay for connecting."""
+    connections = [engine.connect() for _ in range(_warm_size(engine))]
+    try:
+        for connection in connections:
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+async def warm_async_pool(engine):
+    async def open_one():
+        connection = await engine.connect()
+        await connection.execute(text("SELECT 1"))
+        return connection
+
+    # all at once, or each would just get the previous one back from the pool
+    results = await asyncio.gather(*(open_one() for _ in range(_warm_size(engine))), return_exceptions=True)
+    for connection in results:
+        if not isinstance(connection, BaseException):
+            await connection.close()
+    for error in results:
+        if isinstance(error, BaseException):
+            raise error
+
+
+def pool_status():
+    status = {}
+    for name, engine in ENGINES.items():
+        pool = engine.pool
+        stats = POOL_STATS[name]
+        status[name] = {
+            "size": pool.size() if hasattr(pool, "size") else None,
+            "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+            "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+            "checkouts": stats.checkouts,
+            "timeouts": stats.timeouts,
+            "wait_seconds_total": round(stats.wait_seconds_total, 6),
+            "wait_seconds_max": round(stats.wait_seconds_max, 6),
+        }
+    return status
@@ -0,0 +1,137 @@
+"""Streaming export of applications / hiring_stages rows as CSV or NDJSON, GET /export/{table}/.
+
+Rows are filtered like /dashboard/ (positions, departments, start / end date on applied_at /
+conducted_at) and read through a server-side cursor EXPORT_CHUNK_ROWS at a time, each chunk
+encoded and handed on before the next is fetched: memory stays flat whatever the export size,
+and the response goes out chunked as it is read. Reads use the async engines, so a long export
+holds one connection and never the event loop. Files come out in the form bulk_loader.py reads.
+
+    python export.py applications --format csv --department ENGINEERING --start-date 2024-01-01 -o applications.csv
+"""
+import argparse
+import asyncio
+import csv
+import io
+import os
+import sys
+import time
+from datetime import datetime
+from enum import Enum as PyEnum
+
+from dotenv import load_dotenv
+from pathlib import Path
+from loguru import logger as log
+from sqlalchemy import select, text
+
+from db_utils import create_async_db_engine, to_async_url
+from filters import KPIFilter
+from metrics import EXPORT_ROWS
+from models import Application, Stage
+from responses import dumps
+
+load_dotenv(dotenv_path=Path(".env"))
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+# replaces DB_STATEMENT_TIMEOUT_MS for the export's transaction; 0 = none, big exports run long
+EXPORT_STATEMENT_TIMEOUT_MS = int(os.getenv("EXPORT_STATEMENT_TIMEOUT_MS", "0"))
+
+# table -> (model, date column the start / end dates apply to)
+TABLES = {
+    "applications": (Application, Application.applied_at),
+    "hiring_stages": (Stage, Stage.conducted_at),
+}
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def export_statement(table_name: str, filters: KPIFilter):
+    model, date_column = TABLES[table_name]
+    stmt = filters.join_positions(select(*model.__table__.columns), model.position_id)
+    return stmt.where(*filters.where(model.position_id, date_column))
+
+
+def _plain(value):
+    if isinstance(value, PyEnum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_csv(columns: list, rows, header: bool) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    writer.writerows([_plain(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+
+def encode_ndjson(columns: list, rows, header: bool) -> bytes:
+    # orjson writes enums and datetimes itself
+    return b"".join(dumps(dict(zip(columns, row))) + b"\n" for row in rows)
+
+
+ENCODERS = {"csv": encode_csv, "ndjson": encode_ndjson}
+
+
+async def stream_export(engine, table_name: str, filters: KPIFilter, format: str, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """Yields the encoded export chunk by chunk, one chunk of rows in memory at a time."""
+    stmt = export_statement(table_name, filters)
+    columns = [column.name for column in stmt.selected_columns]
+    encode = ENCODERS[format]
+    exported, started = 0, time.perf_counter()
+    try:
+        async with engine.connect() as connection:
+            if connection.dialect.name == "postgresql":
+                await connection.execute(text(f"SET LOCAL statement_timeout = {EXPORT_STATEMENT_TIMEOUT_MS}"))
+            result = await connection.stream(stmt.execution_options(yield_per=chunk_rows), filters.params())
+            if format == "csv":
+                # the header even when nothing matches
+                yield encode(columns, [], header=True)
+            async for rows in result.partitions():
+                yield encode(columns, rows, header=False)
+                exported += len(rows)
+                EXPORT_ROWS.labels(table_name, format).inc(len(rows))
+    finally:
+        # also reached when the client goes away mid-export
+        log.info(f"Exported {exported} {table_name} rows as {format} in {time.perf_counter() - started:.2f}s")
+
+
+async def export_to_file(engine, table_name: str, filters: KPIFilter, format: str, file, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    async for chunk in stream_export(engine, table_name, filters, format, chunk_rows):
+        file.write(chunk)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("table", choices=TABLES.keys())
+    parser.add_argument("--format", choices=ENCODERS.keys(), default="ndjson")
+    parser.add_argument("--position", type=int, action="append", dest="positions", help="repeat for several")
+    parser.add_argument("--department", action="append", dest="departments", help="repeat for several")
+    parser.add_argument("--start-date", type=datetime.fromisoformat)
+    parser.add_argument("--end-date", type=datetime.fromisoformat)
+    parser.add_argument("--chunk-rows", type=int, default=EXPORT_CHUNK_ROWS)
+    parser.add_argument("-o", "--output", help="file to write, stdout when left out")
+    args = parser.parse_args()
+
+    database_url = os.getenv("ASYNC_DATABASE_URL") or to_async_url(os.getenv("DATABASE_URL"))
+    engine = create_async_db_engine(database_url, name="export")
+    filters = KPIFilter.from_dict(
+        {"position_id": args.positions, "departments": args.departments, "start_date": args.start_date, "end_date": args.end_date},
+        engine.dialect.name,
+    )
+
+    async def main():
+        try:
+            if args.output:
+                with open(args.output, "wb") as file:
+                    await export_to_file(engine, args.table, filters, args.format, file, args.chunk_rows)
+            else:
+                await export_to_file(engine, args.table, filters, args.format, sys.stdout.buffer, args.chunk_rows)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(main())
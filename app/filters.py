@@ -0,0 +1,128 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import ARRAY, Date, DateTime, Integer, any_, bindparam
+
+from models import Position
+
+# NEW_APPLICANTS counts applications from the last RECENT_DAYS days
+RECENT_DAYS = 7
+# widest date range still shown per day / per week when the bucket is "auto"
+AUTO_DAY_MAX_SPAN = timedelta(days=92)
+AUTO_WEEK_MAX_SPAN = timedelta(days=731)
+
+
+def resolve_bucket(bucket: Optional[str], start_date: Optional[datetime], end_date: Optional[datetime]) -> str:
+    """day / week / month as asked, or picked from the width of the date range for "auto" / None.
+    Without a start date the range is all of history, which gets months."""
+    if bucket not in (None, "auto"):
+        return bucket
+    if start_date is None:
+        return "month"
+    span = (end_date or datetime.now()) - start_date
+    if span <= AUTO_DAY_MAX_SPAN:
+        return "day"
+    if span <= AUTO_WEEK_MAX_SPAN:
+        return "week"
+    return "month"
+
+
+@dataclass(frozen=True)
+class KPIFilter:
+    """Dashboard filter compiled into SQL predicates for the KPIs.py queries.
+
+    Dimensions left as None add no predicate at all, instead of an always-true range or an
+    IN list of every position. Position ids go to PostgreSQL as a single array parameter
+    (`= ANY(:position_ids)`), so the statement text is the same whatever the list length.
+
+    The predicates hold named bind parameters, never the values: a statement depends only
+    on shape() and is run with params(), so KPIs.py builds each one once per shape.
+
+    bucket and top_positions only shape application_per_job_posting.
+    """
+    position_ids: Optional[tuple[int, ...]] = None
+    departments: Optional[tuple[str, ...]] = None
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    array_binds: bool = True
+    bucket: str = "day"
+    top_positions: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, filters: dict, dialect_name: str = "postgresql"):
+        def _values(values):
+            return tuple(sorted(set(values))) if values else None
+
+        return cls(
+            position_ids=_values(filters.get("position_id")),
+            departments=_values(filters.get("departments")),
+            start_date=filters.get("start_date"),
+            end_date=filters.get("end_date"),
+            array_binds=dialect_name == "postgresql",
+            bucket=resolve_bucket(filters.get("bucket"), filters.get("start_date"), filters.get("end_date")),
+            top_positions=filters.get("top_positions"),
+        )
+
+    def shape(self) -> tuple:
+        """What the SQL depends on: which dimensions are set, not their values."""
+        return (
+            self.position_ids is not None, self.departments is not None, self.start_date is not None,
+            self.end_date is not None, self.array_binds, self.bucket, self.top_positions is not None,
+        )
+
+    def params(self) -> dict:
+        """Values of the bind parameters the predicates below use. The recent-applications
+        cutoff is bound too rather than computed by the database, so it prunes partitions
+        at planning time like the other date bounds."""
+        params = {"recent_since": datetime.utcnow() - timedelta(days=RECENT_DAYS)}
+        if self.position_ids is not None:
+            params["position_ids"] = list(self.position_ids)
+        if self.departments is not None:
+            params["departments"] = list(self.departments)
+        if self.start_date is not None:
+            params["start_date"], params["start_day"] = self.start_date, self.start_date.date()
+        if self.end_date is not None:
+            params["end_date"], params["end_day"] = self.end_date, self.end_date.date()
+        if self.top_positions is not None:
+            params["top_positions"] = self.top_positions
+        return params
+
+    def join_positions(self, stmt, position_column, always: bool = False):
+        """Joins positions only when a department filter (or the caller) needs it."""
+        if always or self.departments is not None:
+            return stmt.join(Position, position_column == Position.id)
+        return stmt
+
+    def position_ids_in(self, column):
+        if self.array_binds:
+            return column == any_(bindparam("position_ids", type_=ARRAY(Integer)))
+        return column.in_(bindparam("position_ids", expanding=True))
+
+    def where(self, position_column, date_column=None, upper: bool = True, department_column=Position.department):
+        """Predicates for the set dimensions. upper=False leaves the end bound to the caller."""
+        conditions = []
+        if self.position_ids is not None:
+            conditions.append(self.position_ids_in(position_column))
+        if self.departments is not None:
+            conditions.append(department_column.in_(bindparam("departments", expanding=True)))
+        if date_column is not None:
+            conditions.extend(self.date_range(date_column, upper=upper))
+        return conditions
+
+    def date_range(self, column, lower: bool = True, upper: bool = True):
+        conditions = []
+        if lower and self.start_date is not None:
+            conditions.append(column >= bindparam("start_date", type_=DateTime))
+        if upper and self.end_date is not None:
+            conditions.append(column <= bindparam("end_date", type_=DateTime))
+        return conditions
+
+    def day_range(self, column):
+        """Whole days of the date bounds, for the rollup tables' day column."""
+        conditions = []
+        if self.start_date is not None:
+            conditions.append(column >= bindparam("start_day", type_=Date))
+        if self.end_date is not None:
+            conditions.append(column <= bindparam("end_day", type_=Date))
+        return conditions
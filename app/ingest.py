@@ -0,0 +1,235 @@
+"""Batch ingest of ATS events: applications and hiring stage transitions, POST /ingest/.
+
+Each row is validated on its own against the models.py enums and the positions / users it
+points at; rows that fail come back in "rejected" with their index and reason, the rest are
+written. Accepted rows are upserted in one transaction with multi-row INSERT ... ON CONFLICT
+DO UPDATE statements of INGEST_CHUNK_ROWS rows, keyed on the composite primary keys; the
+last event in a batch wins when two share a key. Core writes skip the rollups.py mapper
+events, so the same transaction first reads (and locks) the rows being overwritten, sums
+-old / +new per rollup row and sketch bucket for each row whose rollup fields changed, and
+writes the sums with the same multi-row upserts: the cost follows the batch, not the history
+behind it. It also moves the ingest watermark, since events carry their own, possibly older,
+timestamps.
+
+On a partitioned table (see partitions.py) the database key also holds the partition column,
+so an event that changes applied_at / conducted_at wouldn't conflict with the row it replaces;
+there the batch's rows are deleted by the models.py key first, then inserted.
+"""
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+from pathlib import Path
+from loguru import logger as log
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
+from sqlalchemy import delete, text, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select
+
+from cache import kpi_cache
+from metrics import INGEST_ROWS
+from models import (
+    Application, ApplicationStatusEnum, HiringStageNameEnum, Position, Stage, StageStatusEnum, User,
+)
+from partitions import PARTITIONED_TABLES, is_partitioned
+from rollups import APPLICATION_ROLLUP_FIELDS, STAGE_ROLLUP_FIELDS, RollupDeltas
+from watermarks import bump_ingest_watermark
+
+load_dotenv(dotenv_path=Path(".env"))
+
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "1000"))
+INGEST_MAX_BATCH_ROWS = int(os.getenv("INGEST_MAX_BATCH_ROWS", "50000"))
+
+# concurrent batches take turns on PostgreSQL: FOR UPDATE can't lock a row that isn't there
+# yet, and two batches inserting the same new key would both count it in the rollups
+_ADVISORY_LOCK_KEY = 0x696E6765737421
+
+
+def _utc(value: datetime) -> datetime:
+    # the tables hold naive UTC
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class ApplicationEvent(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    candidate_id: int
+    position_id: int
+    applied_at: datetime
+    last_updated: Optional[datetime] = None  # defaults to the time of ingest
+    status: ApplicationStatusEnum
+    last_stage_name: Optional[HiringStageNameEnum] = None
+
+    @field_validator("applied_at", "last_updated")
+    @classmethod
+    def _naive_utc(cls, value):
+        return value if value is None else _utc(value)
+
+
+class StageEvent(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    stage_name: HiringStageNameEnum
+    candidate_id: int
+    position_id: int
+    status: StageStatusEnum
+    feedback: Optional[str] = None
+    conducted_at: datetime
+
+    @field_validator("conducted_at")
+    @classmethod
+    def _naive_utc(cls, value):
+        return _utc(value)
+
+
+class IngestBatch(BaseModel):
+    # rows as sent: each is validated on its own, so one bad row doesn't fail the request
+    applications: list[Any] = []
+    stages: list[Any] = []
+
+    def size(self) -> int:
+        return len(self.applications) + len(self.stages)
+
+
+# batch field -> (event model, table model, rollup fields, RollupDeltas method)
+KINDS = {
+    "applications": (ApplicationEvent, Application, APPLICATION_ROLLUP_FIELDS, RollupDeltas.add_application),
+    "stages": (StageEvent, Stage, STAGE_ROLLUP_FIELDS, RollupDeltas.add_stage),
+}
+
+
+def _validate(kind: str, rows: list, rejected: list) -> dict:
+    """Valid rows keyed by primary key, later rows replacing earlier ones."""
+    event_model, model, _, _ = KINDS[kind]
+    key_columns = [column.name for column in model.__table__.primary_key.columns]
+    now = datetime.utcnow()
+    valid = {}
+    for index, row in enumerate(rows):
+        try:
+            event = event_model.model_validate(row).model_dump()
+        except ValidationError as error:
+            rejected.append({"kind": kind, "index": index, "errors": error.errors(include_url=False, include_context=False, include_input=False)})
+            continue
+        if kind == "applications" and event["last_updated"] is None:
+            event["last_updated"] = now
+        valid[tuple(event[name] for name in key_columns)] = (index, event)
+    return valid
+
+
+def _reject_dangling(db: Session, kind: str, valid: dict, rejected: list):
+    """Drops (and rejects) rows whose position or candidate doesn't exist, which would
+    otherwise fail the whole transaction on the foreign key."""
+    events = [event for _, event in valid.values()]
+    positions = set(db.exec(select(Position.id).where(Position.id.in_({e["position_id"] for e in events}))).all())
+    candidates = set(db.exec(select(User.id).where(User.id.in_({e["candidate_id"] for e in events}))).all())
+    for key, (index, event) in list(valid.items()):
+        missing = [
+            f"{field} {event[field]} does not exist"
+            for field, known in (("position_id", positions), ("candidate_id", candidates))
+            if event[field] not in known
+        ]
+        if missing:
+            rejected.append({"kind": kind, "index": index, "errors": [{"msg": message} for message in missing]})
+            del valid[key]
+
+
+def _lock_existing(db: Session, model, keys: list, fields, chunk_rows: int = INGEST_CHUNK_ROWS) -> dict:
+    """Rollup fields of the rows these keys already have, by key, locked until commit."""
+    key_columns = list(model.__table__.primary_key.columns)
+    existing = {}
+    for start in range(0, len(keys), chunk_rows):
+        stmt = (
+            select(*key_columns, *(model.__table__.c[name] for name in fields))
+            .where(tuple_(*key_columns).in_(keys[start:start + chunk_rows]))
+            .with_for_update()
+        )
+        for row in db.exec(stmt):
+            existing[tuple(row[:len(key_columns)])] = dict(zip(fields, row[len(key_columns):]))
+    return existing
+
+
+def _add_rollup_deltas(db: Session, rollup_deltas: RollupDeltas, kind: str, valid: dict, existing: dict):
+    """-old / +new for every row whose rollup fields change, departments read once for all."""
+    _, _, fields, add = KINDS[kind]
+    changes = []
+    for key, (_, event) in valid.items():
+        old, new = existing.get(key), {name: event[name] for name in fields}
+        if old == new:
+            continue
+        if old is not None:
+            changes.append((old, -1))
+        changes.append((new, +1))
+    if not changes:
+        return
+    position_ids = {values["position_id"] for values, _ in changes}
+    departments = dict(db.exec(select(Position.id, Position.department).where(Position.id.in_(position_ids))).all())
+    for values, sign in changes:
+        add(rollup_deltas, values, sign, departments[values["position_id"]])
+
+
+def upsert_rows(db: Session, model, rows: list, chunk_rows: int = INGEST_CHUNK_ROWS):
+    table = model.__table__
+    postgres = db.get_bind().dialect.name == "postgresql"
+    dialect_insert = postgresql.insert if postgres else sqlite.insert
+    key_columns = list(table.primary_key.columns)
+    conflict_columns = [column.name for column in key_columns]
+    partitioned = postgres and is_partitioned(db.connection(), table.name)
+    if partitioned:
+        conflict_columns.append(PARTITIONED_TABLES[table.name])
+
+    for start in range(0, len(rows), chunk_rows):
+        chunk = rows[start:start + chunk_rows]
+        if partitioned:
+            # the database key can't find the old row if its partition column changed
+            db.exec(delete(table).where(tuple_(*key_columns).in_([tuple(row[c.name] for c in key_columns) for row in chunk])))
+        stmt = dialect_insert(table).values(chunk)
+        db.exec(stmt.on_conflict_do_update(
+            index_elements=conflict_columns,
+            set_={name: stmt.excluded[name] for name in rows[0] if name not in conflict_columns},
+        ))
+
+
+def ingest_batch(db: Session, batch: IngestBatch) -> dict:
+    started = time.perf_counter()
+    rejected, accepted = [], {}
+    rollup_deltas = RollupDeltas()
+    if db.get_bind().dialect.name == "postgresql":
+        db.exec(text("SELECT pg_advisory_xact_lock(:key)"), params={"key": _ADVISORY_LOCK_KEY})
+
+    for kind, (_, model, fields, _) in KINDS.items():
+        valid = _validate(kind, getattr(batch, kind), rejected)
+        if valid:
+            _reject_dangling(db, kind, valid, rejected)
+        rows = [event for _, event in valid.values()]
+        if rows:
+            # read before the upsert overwrites them
+            existing = _lock_existing(db, model, list(valid), fields)
+            upsert_rows(db, model, rows)
+            _add_rollup_deltas(db, rollup_deltas, kind, valid, existing)
+        accepted[kind] = len(rows)
+        INGEST_ROWS.labels(kind, "accepted").inc(len(rows))
+        INGEST_ROWS.labels(kind, "rejected").inc(sum(1 for row in rejected if row["kind"] == kind))
+
+    if any(accepted.values()):
+        rollup_deltas.write(db.connection(), INGEST_CHUNK_ROWS)
+        bump_ingest_watermark(db.connection())
+        db.commit()
+        # core writes don't go through the commit hook in cache.py
+        kpi_cache.invalidate()
+    else:
+        db.rollback()
+
+    elapsed = time.perf_counter() - started
+    written = sum(accepted.values())
+    result = {
+        "accepted": accepted,
+        "rejected": sorted(rejected, key=lambda row: (row["kind"], row["index"])),
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(written / elapsed) if elapsed else written,
+    }
+    log.info(f"Ingested {accepted}, rejected {len(rejected)} rows in {elapsed:.3f}s ({result['rows_per_sec']} rows/s)")
+    return result
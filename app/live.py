@@ -0,0 +1,234 @@
+"""Live dashboards: KPI updates pushed to subscribers when the data under them changes, over
+WebSocket (/dashboard/live/) or server-sent events (/dashboard/live/sse/).
+
+Subscribers with the same filters (same make_filter_key) share one subscription, so an update
+is computed and encoded once and fanned out to all of them; the computation goes through the
+KPI cache, so it is shared with GET /dashboard/ requests for the same view as well. A
+subscriber is only sent a dashboard that differs from the last one it got.
+
+What counts as a change is the KPI cache being invalidated, which every write path here
+already does (ORM commits, POST /ingest/, bulk_loader.py, rollup rebuilds):
+  - in this process, the invalidation wakes the hub at once;
+  - in other workers sharing the Redis cache backend, the generation is polled every
+    LIVE_CHECK_SECONDS;
+  - writes from outside the app are picked up on PostgreSQL through LISTEN/NOTIFY, from
+    statement triggers that migrations.py installs on the KPI tables. A notification
+    invalidates this worker's cache, which fans out as above.
+Updates are sent at most every LIVE_MIN_INTERVAL_SECONDS, so a burst of writes is one update.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+from pathlib import Path
+from loguru import logger as log
+from sqlalchemy import text
+
+from cache import make_filter_key
+from metrics import LIVE_SUBSCRIBERS, LIVE_UPDATES
+from responses import dumps, encoded_bodies
+
+load_dotenv(dotenv_path=Path(".env"))
+
+LIVE_CHECK_SECONDS = float(os.getenv("LIVE_CHECK_SECONDS", "2"))
+LIVE_MIN_INTERVAL_SECONDS = float(os.getenv("LIVE_MIN_INTERVAL_SECONDS", "1"))
+LIVE_MAX_CONCURRENT_UPDATES = int(os.getenv("LIVE_MAX_CONCURRENT_UPDATES", "4"))
+LIVE_KEEPALIVE_SECONDS = float(os.getenv("LIVE_KEEPALIVE_SECONDS", "15"))
+LIVE_LISTEN_NOTIFY = os.getenv("LIVE_LISTEN_NOTIFY", "true").lower() == "true"
+LIVE_LISTEN_RETRY_SECONDS = float(os.getenv("LIVE_LISTEN_RETRY_SECONDS", "10"))
+
+CHANGE_CHANNEL = "kpi_changes"
+CHANGE_TABLES = ("applications", "hiring_stages", "positions")
+
+
+#----------------------Change notifications (PostgreSQL)-----------------------------
+def install_change_triggers(connection):
+    """One NOTIFY per statement touching a KPI table; PostgreSQL folds identical ones within
+    a transaction, so a transaction sends at most one per table."""
+    connection.execute(text(f"""
+        CREATE OR REPLACE FUNCTION kpi_notify_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{CHANGE_CHANNEL}', TG_TABLE_NAME);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """))
+    for table_name in CHANGE_TABLES:
+        connection.execute(text(f'DROP TRIGGER IF EXISTS kpi_notify_change ON "{table_name}"'))
+        connection.execute(text(
+            f'CREATE TRIGGER kpi_notify_change AFTER INSERT OR UPDATE OR DELETE ON "{table_name}" '
+            "FOR EACH STATEMENT EXECUTE FUNCTION kpi_notify_change()"
+        ))
+
+
+async def listen_for_changes(engine, on_change):
+    """Holds one asyncpg connection LISTENing on CHANGE_CHANNEL, reconnecting when it drops."""
+    while True:
+        try:
+            async with engine.connect() as connection:
+                driver_connection = (await connection.get_raw_connection()).driver_connection
+                lost = asyncio.Event()
+                driver_connection.add_termination_listener(lambda _: lost.set())
+                # on_change may block (the Redis backend's INCR), so it runs off the loop
+                loop = asyncio.get_running_loop()
+                await driver_connection.add_listener(CHANGE_CHANNEL, lambda *_: loop.run_in_executor(None, on_change))
+                log.info(f"Listening for KPI table changes on {CHANGE_CHANNEL}")
+                await lost.wait()
+                log.warning("Change notification connection lost")
+        except Exception as error:
+            log.error(f"Listening for change notifications failed: {error}")
+        # writes made meanwhile still reach this worker if they went through the app
+        await asyncio.sleep(LIVE_LISTEN_RETRY_SECONDS)
+
+
+#----------------------Hub-----------------------------
+class Subscription:
+    def __init__(self, filters: dict):
+        self.filters = filters
+        self.queues = set()
+        # subscribed since the last update and sent nothing yet
+        self.waiting = set()
+        self.etag = None
+        self.payload = None
+        self.first_update = None
+
+
+def _offer(queue: asyncio.Queue, payload: str):
+    # latest wins: a subscriber that hasn't read the previous update only gets this one
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(payload)
+
+
+class LiveHub:
+    def __init__(self, cache, compute, interval: float = LIVE_CHECK_SECONDS):
+        """compute(filters) is awaited for {"etag", "dashboard"} (main.cached_dashboard), cache
+        is the KPICache it reads through."""
+        self.cache = cache
+        self.compute = compute
+        self.interval = interval
+        self.subscriptions = {}
+        self._version = None
+        self._changed = None
+        self._loop = None
+        self._watcher = None
+        self._limit = asyncio.Semaphore(LIVE_MAX_CONCURRENT_UPDATES)
+
+    def wake(self):
+        # called on cache invalidation, possibly from a threadpool worker
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._changed.set)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self.cache.listeners.append(self.wake)
+        self._watcher = asyncio.create_task(self.watch())
+
+    def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self.cache.listeners.remove(self.wake)
+
+    async def watch(self):
+        self._version = await self.cache.version()
+        while True:
+            try:
+                await asyncio.wait_for(self._changed.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._changed.clear()
+            version = await self.cache.version()
+            if version == self._version:
+                continue
+            self._version = version
+            await asyncio.gather(*(self.update(key) for key in list(self.subscriptions)))
+            await asyncio.sleep(LIVE_MIN_INTERVAL_SECONDS)
+
+    async def update(self, key: str):
+        """Recomputes one subscription's dashboard and sends it to whoever hasn't got it."""
+        subscription = self.subscriptions.get(key)
+        if subscription is None:
+            return
+        try:
+            async with self._limit:
+                entry = await self.compute(subscription.filters)
+        except Exception as error:
+            # subscribers keep the last update, the next change retries
+            log.error(f"Live dashboard update failed: {error}")
+            return
+
+        # the ETag is a hash of the dashboard, so an unchanged one keeps it
+        if entry["etag"] != subscription.etag:
+            subscription.etag = entry["etag"]
+            body = encoded_bodies.get_or_encode(entry["etag"], None, entry["dashboard"])
+            subscription.payload = f'{{"etag":{dumps(entry["etag"]).decode()},"dashboard":{body.decode()}}}'
+            receivers = subscription.queues
+        else:
+            receivers = subscription.waiting
+        for queue in receivers:
+            _offer(queue, subscription.payload)
+        LIVE_UPDATES.labels("sent" if receivers else "unchanged").inc()
+        subscription.waiting.clear()
+
+    @asynccontextmanager
+    async def subscribe(self, filters: dict):
+        """Queue of JSON payloads ({"etag", "dashboard"}) for these filters, starting with the
+        current dashboard."""
+        key = make_filter_key(filters)
+        subscription = self.subscriptions.setdefault(key, Subscription(filters))
+        queue = asyncio.Queue(maxsize=1)
+        subscription.queues.add(queue)
+        LIVE_SUBSCRIBERS.inc()
+        if subscription.payload is not None:
+            _offer(queue, subscription.payload)
+        else:
+            subscription.waiting.add(queue)
+            # one first update for everyone subscribing before it lands; retried by the next
+            # subscriber if it failed
+            if subscription.first_update is None or subscription.first_update.done():
+                subscription.first_update = asyncio.create_task(self.update(key))
+        try:
+            yield queue
+        finally:
+            LIVE_SUBSCRIBERS.dec()
+            subscription.queues.discard(queue)
+            subscription.waiting.discard(queue)
+            if not subscription.queues:
+                del self.subscriptions[key]
+
+    def status(self):
+        return {"subscriptions": len(self.subscriptions), "subscribers": sum(len(s.queues) for s in self.subscriptions.values())}
+
+
+#----------------------Transports-----------------------------
+async def pump_websocket(websocket, queue: asyncio.Queue):
+    """Sends each update until the client disconnects; anything the client sends is ignored."""
+    receiving = asyncio.ensure_future(websocket.receive())
+    update = asyncio.ensure_future(queue.get())
+    try:
+        while True:
+            await asyncio.wait({update, receiving}, return_when=asyncio.FIRST_COMPLETED)
+            if update.done():
+                await websocket.send_text(update.result())
+                update = asyncio.ensure_future(queue.get())
+            if receiving.done():
+                if receiving.result()["type"] == "websocket.disconnect":
+                    return
+                receiving = asyncio.ensure_future(websocket.receive())
+    finally:
+        receiving.cancel()
+        update.cancel()
+
+
+async def event_stream(hub: LiveHub, filters: dict):
+    """Server-sent events: one `data:` event per update, a comment line as keepalive."""
+    async with hub.subscribe(filters) as queue:
+        while True:
+            try:
+                payload = await asyncio.wait_for(queue.get(), LIVE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            yield b"data: " + payload.encode() + b"\n\n"
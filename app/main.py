@@ -1,15 +1,32 @@
 from datetime import datetime
+import asyncio
 import os
-from typing import Annotated, Optional 
-from fastapi import Depends, FastAPI, HTTPException, Query, status
+from typing import Annotated, Literal, Optional 
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, WebSocket, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlmodel import Session, create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from loguru import logger as log
 
-from KPIs import application_per_job_posting, get_all_positions, get_application_status_data, get_candidate_stage_data, get_recent_applications_count, get_time_to_hire_all_depts
-from auth import create_access_token, hash_password, verify_access_token, verify_password
-from db_utils import check_db_connection
-from models import  DepartmentEnum, User     
+from auth import HashingOverloaded, create_access_token, hash_password_async, verify_access_token, verify_password_async
+from cache import CoalesceTimeout, kpi_cache, make_filter_key
+from export import MEDIA_TYPES, TABLES as EXPORT_TABLES, stream_export
+from filters import KPIFilter
+from dashboard import build_dashboard_async, build_dashboard_delta_async, build_dashboard_from_snapshot
+from db_utils import check_db_connection, create_async_db_engine, create_db_engine, pool_status, to_async_url
+from metrics import render_metrics, track_request
+from ingest import INGEST_MAX_BATCH_ROWS, IngestBatch, ingest_batch
+from live import LIVE_LISTEN_NOTIFY, LiveHub, event_stream, listen_for_changes, pump_websocket
+from models import User 
+from partitions import partition_maintainer
+from replicas import ReadTarget, ReplicaRouter
+from responses import dumps, etag_matches, json_response, not_modified, versioned
+from snapshot import DASHBOARD_BACKEND, SnapshotStore
+from warmup import Readiness, warm_up
+from watermarks import get_ingest_watermark, next_watermark
+import rollups  # registers the listeners that keep the daily rollups in step    
 from dotenv import load_dotenv
 from pathlib import Path
 from pydantic import BaseModel
@@ -32,12 +49,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+#---------------------------Metrics--------------------------
+app.middleware("http")(track_request)
+
+
+@app.get("/metrics")
+def get_metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 #----------------------Database connection-----------------------------
 
 load_dotenv(dotenv_path=Path(".env"))
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+engine = create_db_engine(DATABASE_URL, name="primary")
 
 #using fastapi dependency
 def get_session():
@@ -46,6 +72,30 @@ def get_session():
         
 SessionDep = Annotated[Session, Depends(get_session)]
 
+# asyncio path for the async routes, so queries don't block the event loop
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+async_engine = create_async_db_engine(ASYNC_DATABASE_URL, name="primary_async")
+async_session_factory = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+async def get_async_session():
+    async with async_session_factory() as db:
+        yield db
+
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_session)]
+
+# KPI reads go to the read replicas when DATABASE_REPLICA_URLS is set, see replicas.py
+read_router = ReplicaRouter.from_urls(async_engine)
+ReadTargetDep = Annotated[ReadTarget, Depends(read_router.choose)]
+
+# in-memory columnar copy of the KPI tables for ?backend=snapshot, see snapshot.py
+snapshot_store = SnapshotStore(engine, kpi_cache)
+
+# pushes dashboard updates to /dashboard/live/ subscribers, see live.py
+live_hub = LiveHub(kpi_cache, lambda filters: cached_dashboard(filters, read_router.choose()))
+
+# flipped by the warm-up started at startup, reported on GET /ready
+readiness = Readiness()
+
 # -------------------------- AUTH ----------------------------------
 class Credentials(BaseModel):
     username: str
@@ -67,26 +117,39 @@ UserDep = Annotated[dict, Depends(get_current_user)]
 
 #----------------------ROUTES-----------------------------
 @app.post("/register/")
-def register(user: Credentials, db: SessionDep):
+async def register(user: Credentials, db: AsyncSessionDep):
     log.info("Registering ...", Credentials)
-    db_user = db.exec(select(User).where(User.email == user.username)).first()
+    db_user = (await db.exec(select(User).where(User.email == user.username))).first()
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             message="email already registered",
         )
-    hashed_password = hash_password(user.password)
+    try:
+        hashed_password = await hash_password_async(user.password)
+    except HashingOverloaded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many registrations in progress, try again shortly",
+        )
     new_user = User(name="admin", email=user.username, hashed_password=hashed_password)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return {"message": "User created successfully"}
 
 @app.post("/login/", )
-async def login(user:Credentials, db: SessionDep):
+async def login(user:Credentials, db: AsyncSessionDep):
     log.info("Logging in ...", user)
-    db_user = db.exec(select(User).where(User.email == user.username)).first()
-    if not db_user or not verify_password(user.password, db_user.hashed_password):
+    db_user = (await db.exec(select(User).where(User.email == user.username))).first()
+    try:
+        valid = db_user is not None and await verify_password_async(user.password, db_user.hashed_password)
+    except HashingOverloaded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins in progress, try again shortly",
+        )
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password",
@@ -97,6 +160,17 @@ async def login(user:Credentials, db: SessionDep):
 
 
 
+@app.post("/ingest/")
+def ingest_events(batch: IngestBatch, current_user: UserDep, db: SessionDep):
+    """Upserts a batch of ATS application / stage events; invalid rows come back in "rejected"."""
+    if batch.size() > INGEST_MAX_BATCH_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {INGEST_MAX_BATCH_ROWS} rows per batch",
+        )
+    return ingest_batch(db, batch)
+
+
 @app.get("/")
 async def home():
     return {"message": "Hello World"}
@@ -107,56 +181,155 @@ def protected_route(current_user: UserDep):
     return {"message": f"Hello {current_user['sub']}, you are authenticated!"}
 
 
-@app.get("/dashboard/")
-async def get_dashboard_data(
-    db: SessionDep,
-    current_user: UserDep,
+@app.get("/ready")
+def get_readiness():
+    """For the load balancer: 503 until this worker's warm-up (warmup.py) has finished."""
+    status_code = status.HTTP_200_OK if readiness.ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    return Response(content=dumps(readiness.status()), media_type="application/json", status_code=status_code)
+
+
+@app.get("/pool/")
+def get_pool_status(current_user: UserDep):
+    return pool_status()
+
+
+@app.get("/replicas/")
+def get_replica_status(current_user: UserDep):
+    return read_router.status()
+
+
+@app.get("/snapshot/")
+def get_snapshot_status(current_user: UserDep):
+    return snapshot_store.status()
+
+
+def dashboard_filters(
     positions: Optional[list[int]] = Query(None, description="Filter by position IDs", alias="positions[]"),
     departments: Optional[list[str]] = Query(None, description="Filter by department IDs", alias="departments[]"),
     start_date: Optional[datetime] = Query(None, description="Filter data after this date"),
     end_date: Optional[datetime] = Query(None, description="Filter data before this date"),
+    bucket: Literal["auto", "day", "week", "month"] = Query("auto", description="Time bucket of application_per_job_posting"),
+    top_positions: Optional[int] = Query(None, ge=1, description="Keep this many positions in application_per_job_posting, sum the rest as 'Other'"),
 ):
-    filters = {
+    return {
         "position_id": positions,
         "departments": departments,
         "start_date": start_date,
         "end_date": end_date,
+        "bucket": bucket,
+        "top_positions": top_positions,
     }
+
+DashboardFiltersDep = Annotated[dict, Depends(dashboard_filters)]
+
+
+@app.get("/dashboard/")
+async def get_dashboard_data(
+    request: Request,
+    current_user: UserDep,
+    filters: DashboardFiltersDep,
+    target: ReadTargetDep,
+    backend: Literal["sql", "snapshot"] = Query(DASHBOARD_BACKEND, description="Answer from SQL or from the in-memory snapshot"),
+):
     log.debug(current_user)
-    print(filters)
+    log.debug(filters)
 
-    if(departments is None) :
-        filters["departments"] = [department.value for department in DepartmentEnum]
-    
-    if start_date is None :
-        filters["start_date"] = datetime.min
+    if backend == "snapshot":
+        # versioned by the snapshot itself, which can trail the cache generation by a reload
+        snapshot = await snapshot_store.get()
+        etag = f'"{make_filter_key(filters)}-{snapshot.version}"'
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified(etag)
+        return json_response(build_dashboard_from_snapshot(snapshot, filters), etag, request.headers.get("accept-encoding"))
 
-    if end_date is None :
-        filters["end_date"] = datetime.max
+    try:
+        entry = await cached_dashboard(filters, target)
+    except CoalesceTimeout:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Dashboard is taking long to compute, try again shortly",
+        )
+    # a cache hit answers a revalidation without computing anything; a recomputed dashboard
+    # that came out the same does too, its ETag being a hash of the data
+    if etag_matches(request.headers.get("if-none-match"), entry["etag"]):
+        return not_modified(entry["etag"])
+    return json_response(entry["dashboard"], entry["etag"], request.headers.get("accept-encoding"))
 
-    all_positions = get_all_positions(db);
-    if positions is None:
-        filters["position_id"] = list(all_positions.keys())
 
-    print(filters)
+def cached_dashboard(filters: dict, target: ReadTarget):
+    """The cached {"etag", "dashboard"} for these filters (see responses.versioned), computed on a miss."""
+    async def compute():
+        return versioned(await read_router.run(target, lambda t: build_dashboard_async(t.session_factory, t.dialect_name, filters)))
 
-    all_application_status = get_application_status_data(db, filters); 
+    return kpi_cache.get_or_compute_async(filters, compute)
 
-    response = {
-        'all_positions': all_positions,
-        'all_departments' : [department.value for department in DepartmentEnum],
-        'candidate_stage_counts': get_candidate_stage_data(db, filters),
-        'depts_time_to_hire': get_time_to_hire_all_depts(db, filters),
-        'offer_status': {"OFFER_ACCEPTED" : all_application_status.get("ACCEPTED",0), "OFFER_DECLINED": all_application_status.get("DECLINED",0), "OFFER_PENDING": all_application_status.get("OFFERED",0)},
-        'application_status_count' : {"WAITING": all_application_status.get("IN_PROGRESS",0), "NO_ACTION": all_application_status.get("APPLIED",0), "NEW_APPLICANTS":get_recent_applications_count(db, filters)},
-        'application_per_job_posting': application_per_job_posting(db,filters)
-    }
-    response['candidate_stage_counts'] = {
-        "TOTAL_APPLICATIONS": response['candidate_stage_counts'].get("RESUME_SCREENING", 0) + all_application_status.get("APPLIED",0),
-        **response['candidate_stage_counts']  # Unpacking the rest of the items
-    }
 
-    return response
+@app.websocket("/dashboard/live/")
+async def dashboard_live(
+    websocket: WebSocket,
+    filters: DashboardFiltersDep,
+    token: str = Query(..., description="Access token from /login/; browsers can't set headers on a WebSocket"),
+):
+    """Sends the dashboard as {"etag", "dashboard"} on connect, then again whenever it changes."""
+    if verify_access_token(token) is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid or expired token")
+        return
+    await websocket.accept()
+    async with live_hub.subscribe(filters) as updates:
+        await pump_websocket(websocket, updates)
+
+
+@app.get("/dashboard/live/sse/")
+async def dashboard_live_events(current_user: UserDep, filters: DashboardFiltersDep):
+    """As /dashboard/live/, as server-sent events."""
+    return StreamingResponse(
+        event_stream(live_hub, filters),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/live/")
+def get_live_status(current_user: UserDep):
+    return live_hub.status()
+
+
+@app.get("/dashboard/delta/")
+async def get_dashboard_delta(
+    current_user: UserDep,
+    filters: DashboardFiltersDep,
+    target: ReadTargetDep,
+    since: Optional[datetime] = Query(None, description="The watermark returned by the previous call"),
+):
+    # taken before reading, so anything committed meanwhile is in the next delta
+    watermark = next_watermark(target.lag)
+
+    async def delta(target: ReadTarget):
+        async with target.session_factory() as db:
+            ingested_at = await get_ingest_watermark(db)
+        if since is None or (ingested_at is not None and ingested_at > since):
+            # not from kpi_cache: an entry can be older than the watermark handed out with it
+            return {"full": True, "watermark": watermark, "dashboard": await build_dashboard_async(target.session_factory, target.dialect_name, filters)}
+        return {"full": False, "watermark": watermark, "changes": await build_dashboard_delta_async(target.session_factory, target.dialect_name, filters, since)}
+
+    body = await read_router.run(target, delta)
+    return Response(content=dumps(body), media_type="application/json")
+
+@app.get("/export/{table_name}/")
+async def export_rows(
+    table_name: Literal[tuple(EXPORT_TABLES)],
+    current_user: UserDep,
+    filters: DashboardFiltersDep,
+    target: ReadTargetDep,
+    format: Literal[tuple(MEDIA_TYPES)] = Query("ndjson", description="csv or ndjson"),
+):
+    """Streams the filtered rows through a server-side cursor, see export.py."""
+    kpi_filter = KPIFilter.from_dict(filters, target.dialect_name)
+    return StreamingResponse(
+        stream_export(target.engine, table_name, kpi_filter, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{table_name}.{format}"'},
+    )
 
 #----------------------START_UP-----------------------------
 @app.on_event("startup")
@@ -171,4 +344,51 @@ def on_startup():
             log.info(connection_info["status"])
             log.error(connection_info["error"])
             exit()
- 
\ No newline at end of file
+ 
+
+@app.on_event("startup")
+async def start_replica_monitor():
+    if read_router.replicas:
+        app.state.replica_monitor = asyncio.create_task(read_router.monitor())
+
+
+@app.on_event("startup")
+async def start_partition_maintainer():
+    # adds next months' partitions ahead of time, a no-op until partitions.py migrate has run
+    if engine.dialect.name == "postgresql":
+        app.state.partition_maintainer = asyncio.create_task(partition_maintainer(engine))
+
+
+@app.on_event("startup")
+async def start_live_updates():
+    live_hub.start()
+    # writes from outside the app only show up as PostgreSQL notifications
+    if LIVE_LISTEN_NOTIFY and async_engine.dialect.driver == "asyncpg":
+        app.state.change_listener = asyncio.create_task(listen_for_changes(async_engine, kpi_cache.invalidate))
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    # in the background, so /ready can answer 503 while it runs
+    if not readiness.ready:
+        app.state.warm_up = asyncio.create_task(readiness.run(lambda state: warm_up(
+            state, engine, read_router, snapshot_store, cached_dashboard,
+            load_snapshot=DASHBOARD_BACKEND == "snapshot",
+        )))
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if read_router.replicas:
+        app.state.replica_monitor.cancel()
+        await read_router.dispose()
+    snapshot_store.stop()
+    live_hub.stop()
+    if LIVE_LISTEN_NOTIFY and async_engine.dialect.driver == "asyncpg":
+        app.state.change_listener.cancel()
+    if engine.dialect.name == "postgresql":
+        app.state.partition_maintainer.cancel()
+    if not readiness.ready:
+        app.state.warm_up.cancel()
+    await async_engine.dispose()
+    engine.dispose()
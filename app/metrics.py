@@ -0,0 +1,134 @@
+"""Prometheus metrics for the API: request latency, per-KPI latency and row counts,
+database queries per request and a slow-query log. Scraped from GET /metrics.
+"""
+import functools
+import inspect
+import os
+import time
+from contextvars import ContextVar
+
+from dotenv import load_dotenv
+from pathlib import Path
+from loguru import logger as log
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+load_dotenv(dotenv_path=Path(".env"))
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"],
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "Database statements executed per request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+KPI_DURATION = Histogram("kpi_duration_seconds", "Latency of one KPI function", ["kpi"])
+KPI_ROWS = Histogram(
+    "kpi_rows", "Rows returned by one KPI function", ["kpi"],
+    buckets=(0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000),
+)
+QUERY_DURATION = Histogram("db_query_duration_seconds", "Latency of one database statement")
+SLOW_QUERIES = Counter("db_slow_queries_total", f"Statements slower than SLOW_QUERY_MS ({SLOW_QUERY_MS:g} ms)")
+COMPILED_CACHE = Counter(
+    "db_compiled_cache_total", "SQLAlchemy compiled-statement cache lookups per executed statement", ["result"],
+)
+KPI_COALESCED = Counter(
+    "kpi_coalesced_requests_total", "Dashboard computations joined while an identical one was in flight",
+)
+KPI_COALESCE_TIMEOUTS = Counter(
+    "kpi_coalesce_timeouts_total", "Requests that gave up waiting on an identical in-flight computation",
+)
+INGEST_ROWS = Counter("ingest_rows_total", "Rows received by POST /ingest/", ["kind", "result"])
+LIVE_SUBSCRIBERS = Gauge("live_subscribers", "Clients subscribed to live dashboard updates")
+LIVE_UPDATES = Counter(
+    "live_updates_total", "Live dashboard recomputations, sent to subscribers or unchanged and not sent", ["result"],
+)
+EXPORT_ROWS = Counter("export_rows_total", "Rows streamed out by GET /export/ and export.py", ["table", "format"])
+KPI_STATEMENT_CACHE = Counter(
+    "kpi_statement_cache_total", "KPI statements reused (hit) or built (miss) for a filter shape", ["result"],
+)
+
+# a one-item list rather than an int, so tasks spawned by asyncio.gather (which copy the
+# context) still add to the request's count
+_request_queries: ContextVar = ContextVar("request_queries", default=None)
+
+
+#----------------------Requests-----------------------------
+async def track_request(request, call_next):
+    """HTTP middleware: times the request and counts the statements it ran."""
+    queries = [0]
+    token = _request_queries.set(queries)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        _request_queries.reset(token)
+        # the route template, not the raw path, keeps label cardinality bounded
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        REQUEST_DURATION.labels(request.method, route, status).observe(time.perf_counter() - started)
+        REQUEST_QUERIES.labels(route).observe(queries[0])
+
+
+def render_metrics():
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+#----------------------KPIs-----------------------------
+def _row_count(result):
+    if isinstance(result, dict):
+        return sum(len(value) if isinstance(value, dict) else 1 for value in result.values())
+    return 1
+
+
+def instrument_kpi(name: str):
+    """Records the latency and returned row count of a KPI function, sync or async."""
+    def decorator(kpi):
+        if inspect.iscoroutinefunction(kpi):
+            @functools.wraps(kpi)
+            async def timed_async(*args, **kwargs):
+                started = time.perf_counter()
+                result = await kpi(*args, **kwargs)
+                KPI_DURATION.labels(name).observe(time.perf_counter() - started)
+                KPI_ROWS.labels(name).observe(_row_count(result))
+                return result
+            return timed_async
+
+        @functools.wraps(kpi)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            result = kpi(*args, **kwargs)
+            KPI_DURATION.labels(name).observe(time.perf_counter() - started)
+            KPI_ROWS.labels(name).observe(_row_count(result))
+            return result
+        return timed
+    return decorator
+
+
+#----------------------Queries-----------------------------
+# on the Engine class, so every engine (and the sync side of every async engine) reports
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    QUERY_DURATION.observe(elapsed)
+    if context is not None:
+        # cache_hit / cache_miss; a miss is a compile on the request path
+        COMPILED_CACHE.labels(context.cache_hit.name.lower()).inc()
+
+    queries = _request_queries.get()
+    if queries is not None:
+        queries[0] += 1
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc()
+        log.warning(f"Slow query ({elapsed * 1000:.0f} ms): {' '.join(statement.split())[:1000]}")
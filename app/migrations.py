@@ -0,0 +1,95 @@
+"""Creates missing tables and the KPI indexes declared in models.py on an existing database.
+
+Rollup tables (see rollups.py) created here on a database that already holds applications or
+hiring stages are filled from them before anything reads them, since KPIs.py reads the
+rollups by default (KPI_USE_ROLLUPS).
+
+On PostgreSQL each index is built with CREATE INDEX CONCURRENTLY, so live tables keep
+taking writes while it runs. A concurrent build that failed half way leaves an INVALID
+index behind; those are dropped and rebuilt. Partitioned tables (see partitions.py) can't
+build concurrently; their indexes are created on the parent, which cascades to every partition.
+
+    python migrations.py
+"""
+import os
+
+from dotenv import load_dotenv
+from pathlib import Path
+from loguru import logger as log
+from sqlalchemy import func, inspect, text
+from sqlalchemy.schema import CreateIndex
+from sqlmodel import Session, SQLModel, select
+
+from db_utils import create_db_engine
+from live import install_change_triggers
+from models import Application, ApplicationDailyRollup, HireTimeSketch, Stage, StageDailyRollup
+from partitions import is_partitioned
+from rollups import rebuild_rollups
+
+import models  # noqa: F401  registers every table on SQLModel.metadata
+
+load_dotenv(dotenv_path=Path(".env"))
+
+KPI_TABLES = ("applications", "hiring_stages", "positions")
+ROLLUP_TABLES = tuple(model.__tablename__ for model in (ApplicationDailyRollup, StageDailyRollup, HireTimeSketch))
+
+
+def kpi_indexes():
+    for table_name in KPI_TABLES:
+        yield from SQLModel.metadata.tables[table_name].indexes
+
+
+def _invalid_indexes(connection):
+    return set(connection.execute(text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+    )).scalars())
+
+
+def create_kpi_indexes(engine):
+    if engine.dialect.name != "postgresql":
+        for index in kpi_indexes():
+            index.create(engine, checkfirst=True)
+        return
+
+    # CONCURRENTLY can't run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        invalid = _invalid_indexes(connection)
+        partitioned = {table_name for table_name in KPI_TABLES if is_partitioned(connection, table_name)}
+        for index in kpi_indexes():
+            if index.name in invalid:
+                log.warning(f"Dropping invalid index {index.name} left by an earlier build")
+                connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+
+            ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+            if index.table.name not in partitioned:
+                ddl = ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+            log.info(ddl)
+            connection.execute(text(ddl))
+
+        for table_name in KPI_TABLES:
+            connection.execute(text(f"ANALYZE {table_name}"))
+
+
+def create_missing_tables(engine):
+    """Tables added since the database was created (rollups, ingest watermarks); existing ones
+    are left alone. New rollup tables are backfilled from the history already there."""
+    existing = set(inspect(engine).get_table_names())
+    SQLModel.metadata.create_all(engine)
+    created = [table_name for table_name in ROLLUP_TABLES if table_name not in existing]
+    if not created:
+        return
+    with Session(engine) as db:
+        history = db.exec(select(func.count()).select_from(Application)).one() + db.exec(select(func.count()).select_from(Stage)).one()
+        if history:
+            log.info(f"Backfilling new rollup tables {created} from {history} existing rows")
+            rebuild_rollups(db)
+
+
+if __name__ == "__main__":
+    engine = create_db_engine(os.getenv("DATABASE_URL"), name="migrations")
+    create_missing_tables(engine)
+    create_kpi_indexes(engine)
+    if engine.dialect.name == "postgresql":
+        # NOTIFYs the live dashboards (live.py) of writes made outside the app
+        with engine.begin() as connection:
+            install_change_triggers(connection)
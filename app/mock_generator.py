@@ -1,6 +1,11 @@
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import csv
+from datetime import datetime, timedelta
 import json
+import math
 import os
+import random
 from random import choice
 from faker import Faker
 from loguru import logger as log
@@ -33,7 +38,7 @@ def save(data, path) :
 def create_mock_users(n: int):
     for _ in range(n):
         user = {
-            "id": faker.unique.random_int(min=1, max=1000),
+            "id": len(users_data) + 1,
             "name": faker.name(),
             "email": faker.unique.email(),
             "hashed_password": faker.sha256(),
@@ -46,7 +51,7 @@ def create_mock_users(n: int):
 def create_mock_positions(n: int):
     for _ in range(n):
         user = {
-            "id": faker.unique.random_int(min=1, max=1000),
+            "id": len(positions_data) + 1,
             "title": faker.job(),
             "department": choice(list(DepartmentEnum)),
             "status": choice(list(PositionStatusEnum)), # TODO: 0 candidates accepted but position filled
@@ -58,14 +63,40 @@ def create_mock_positions(n: int):
         
 
 # Ensure candidate_id and position_id combinations are unique in applications_data
+existing_pairs = set()
+
 def generate_unique_candidate_position_pair(users_data, positions_data, applications_data):
-    existing_pairs = {(app["candidate_id"], app["position_id"]) for app in applications_data}
     while True:
         candidate_id = choice(users_data)["id"]
         position_id = choice(positions_data)["id"]
         if (candidate_id, position_id) not in existing_pairs:
+            existing_pairs.add((candidate_id, position_id))
             return candidate_id, position_id
         
+# Application status has to agree with how far the candidate got
+def pick_status(last_stage_name, choose):
+    if last_stage_name in [HiringStageNameEnum.RESUME_SCREENING, 
+                             HiringStageNameEnum.TEST_SCREENING, 
+                             HiringStageNameEnum.PHONE_SCREENING, 
+                             HiringStageNameEnum.TECHNICAL_INTERVIEW_1,
+                             HiringStageNameEnum.TECHNICAL_INTERVIEW_2]:
+        return choose([
+            ApplicationStatusEnum.IN_PROGRESS,
+            ApplicationStatusEnum.REJECTED,
+            ApplicationStatusEnum.WITHDRAWN
+        ])
+    elif last_stage_name == HiringStageNameEnum.HR_MANAGERIAL_INTERVIEW:
+        return choose([
+            ApplicationStatusEnum.OFFERED,
+            ApplicationStatusEnum.REJECTED
+        ])  
+    elif last_stage_name == HiringStageNameEnum.OFFER_NEGOTIATION:
+        return choose([
+            ApplicationStatusEnum.ACCEPTED,
+            ApplicationStatusEnum.DECLINED
+        ])  
+    return ApplicationStatusEnum.APPLIED
+
 # Generate mock applications data
 def create_mock_applications(n: int):
     for _ in range(n):
@@ -75,30 +106,8 @@ def create_mock_applications(n: int):
         last_updated = faker.date_time_between(start_date=applied_at)
         
         last_stage_name = choice(list(HiringStageNameEnum) + [None])
-                        
-        if last_stage_name in [HiringStageNameEnum.RESUME_SCREENING, 
-                                 HiringStageNameEnum.TEST_SCREENING, 
-                                 HiringStageNameEnum.PHONE_SCREENING, 
-                                 HiringStageNameEnum.TECHNICAL_INTERVIEW_1,
-                                 HiringStageNameEnum.TECHNICAL_INTERVIEW_2]:
-            status = choice([
-                ApplicationStatusEnum.IN_PROGRESS,
-                ApplicationStatusEnum.REJECTED,
-                ApplicationStatusEnum.WITHDRAWN
-            ])
-        elif last_stage_name == HiringStageNameEnum.HR_MANAGERIAL_INTERVIEW:
-            status = choice([
-                ApplicationStatusEnum.OFFERED,
-                ApplicationStatusEnum.REJECTED
-            ])  
-        elif last_stage_name == HiringStageNameEnum.OFFER_NEGOTIATION:
-                status = choice([
-                ApplicationStatusEnum.ACCEPTED,
-                ApplicationStatusEnum.DECLINED
-            ])  
-        else:
-            status=ApplicationStatusEnum.APPLIED
-            
+        status = pick_status(last_stage_name, choice)
+
 
         application: Application = {
             "candidate_id": candidate_id,  
@@ -115,6 +124,7 @@ def create_mock_applications(n: int):
     
     # TODO: NUMBER_OF_OPENINGS FOR A POSITION. IN MOCK DATA x CANDIDATES MAY BE FILLED FOR A POSITION 
     save(applications_data, APPLICATIONS_MOCK_DATA)
+    save(stages_data, STAGES_MOCK_DATA)
 
 
 def create_mock_stages(application : Application):
@@ -148,15 +158,197 @@ def create_mock_stages(application : Application):
         stages_data.append(stage_entry) 
         if stage == application["last_stage_name"]:
             break
-    
-    save(stages_data, STAGES_MOCK_DATA)
+
+#----------------------Scalable, sharded generation-----------------------------
+# Each table is split into shards written independently (optionally by a process pool).
+# Shard output depends only on (seed, table, shard), so any worker count gives the same files.
+FIELDS = {
+    "users": ["id", "name", "email", "hashed_password"],
+    "positions": ["id", "title", "department", "status", "created_at"],
+    "applications": ["candidate_id", "position_id", "applied_at", "last_updated", "status", "last_stage_name"],
+    "hiring_stages": ["stage_name", "candidate_id", "position_id", "status", "conducted_at", "feedback"],
+}
+HISTORY_DAYS = 365
+
+
+class ShardWriter:
+    def __init__(self, path: str, fields: list, fmt: str):
+        self.file = open(path, "w", newline="")
+        self.fmt = fmt
+        if fmt == "csv":
+            self.writer = csv.DictWriter(self.file, fieldnames=fields)
+            self.writer.writeheader()
+
+    def write(self, row: dict):
+        if self.fmt == "csv":
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+def _shard_rng(seed: int, table: str, shard: int):
+    rng = random.Random(f"{seed}:{table}:{shard}")
+    fake = Faker()
+    fake.seed_instance(rng.getrandbits(32))
+    return rng, fake
+
+
+def _pair_permutation(seed: int, users: int, positions: int):
+    """(multiplier, offset) of an affine bijection over every candidate x position slot, so
+    application j -> slot (a*j + b) % space is unique without remembering earlier pairs."""
+    space = users * positions
+    rng = random.Random(f"{seed}:pairs")
+    multiplier = rng.randrange(1, space) | 1 if space > 1 else 1
+    while math.gcd(multiplier, space) != 1:
+        multiplier += 2
+    return multiplier, rng.randrange(space)
+
+
+def _write_users(rng, fake, start, stop, out):
+    for user_id in range(start + 1, stop + 1):
+        out["users"].write({
+            "id": user_id,
+            "name": fake.name(),
+            "email": f"{fake.user_name()}.{user_id}@{fake.free_email_domain()}",
+            "hashed_password": fake.sha256(),
+        })
+
+
+def _write_positions(rng, fake, start, stop, until, out):
+    for position_id in range(start + 1, stop + 1):
+        out["positions"].write({
+            "id": position_id,
+            "title": fake.job()[:100],
+            "department": rng.choice(list(DepartmentEnum)).value,
+            "status": rng.choice(list(PositionStatusEnum)).value,
+            "created_at": (until - timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))).isoformat(),
+        })
+
+
+def _write_applications(rng, fake, start, stop, config, out):
+    until = config["until"]
+    multiplier, offset = config["pairs"]
+    space = config["users"] * config["positions"]
+    stage_names = list(HiringStageNameEnum)
+
+    for j in range(start, stop):
+        slot = (multiplier * j + offset) % space
+        candidate_id, position_id = slot // config["positions"] + 1, slot % config["positions"] + 1
+
+        last_stage_name = rng.choice(stage_names + [None])
+        status = pick_status(last_stage_name, rng.choice)
+
+        # stages happen in order between applying and the last update, which is no later than
+        # until: applied_at is drawn after the gaps, early enough for all of them to fit
+        stages_reached = [] if last_stage_name is None else stage_names[:stage_names.index(last_stage_name) + 1]
+        gaps = [rng.randrange(1, 7 * 86400) for _ in stages_reached]
+        applied_at = until - timedelta(seconds=sum(gaps) + rng.randrange(max(HISTORY_DAYS * 86400 - sum(gaps), 1)))
+        conducted_at = applied_at
+        for stage, gap in zip(stages_reached, gaps):
+            conducted_at += timedelta(seconds=gap)
+            failed = stage == last_stage_name and status == ApplicationStatusEnum.REJECTED
+            out["hiring_stages"].write({
+                "stage_name": stage.value,
+                "candidate_id": candidate_id,
+                "position_id": position_id,
+                "status": (StageStatusEnum.FAILED if failed else StageStatusEnum.PASSED).value,
+                "conducted_at": conducted_at.isoformat(),
+                "feedback": fake.sentence(),
+            })
+
+        out["applications"].write({
+            "candidate_id": candidate_id,
+            "position_id": position_id,
+            "applied_at": applied_at.isoformat(),
+            "last_updated": conducted_at.isoformat(),
+            "status": status.value,
+            "last_stage_name": last_stage_name.value if last_stage_name else None,
+        })
+
+
+def write_shard(task: dict):
+    table, shard, start, stop, config = task["table"], task["shard"], task["start"], task["stop"], task["config"]
+    rng, fake = _shard_rng(config["seed"], table, shard)
+    tables = ["applications", "hiring_stages"] if table == "applications" else [table]
+    out = {
+        name: ShardWriter(os.path.join(config["out_dir"], f"{name}-{shard:04d}.{config['format']}"), FIELDS[name], config["format"])
+        for name in tables
+    }
+    try:
+        if table == "users":
+            _write_users(rng, fake, start, stop, out)
+        elif table == "positions":
+            _write_positions(rng, fake, start, stop, config["until"], out)
+        else:
+            _write_applications(rng, fake, start, stop, config, out)
+    finally:
+        for writer in out.values():
+            writer.close()
+    return table, shard, stop - start
+
+
+def _shard_tasks(table: str, total: int, shards: int, config: dict):
+    size = math.ceil(total / shards) if total else 0
+    for shard in range(shards):
+        start, stop = shard * size, min(total, (shard + 1) * size)
+        if start < stop:
+            yield {"table": table, "shard": shard, "start": start, "stop": stop, "config": config}
+
+
+def generate_dataset(out_dir: str, users: int, positions: int, applications: int, seed: int = 0,
+                     shards: int = 1, workers: int = 1, fmt: str = "ndjson", until: datetime = None):
+    if applications > users * positions:
+        raise ValueError("more applications than distinct (candidate, position) pairs")
+
+    os.makedirs(out_dir, exist_ok=True)
+    config = {
+        "out_dir": out_dir,
+        "format": fmt,
+        "seed": seed,
+        "users": users,
+        "positions": positions,
+        "until": until or datetime.combine(datetime.utcnow().date(), datetime.min.time()),
+        "pairs": _pair_permutation(seed, users, positions),
+    }
+    tasks = [
+        *_shard_tasks("users", users, shards, config),
+        *_shard_tasks("positions", positions, shards, config),
+        *_shard_tasks("applications", applications, shards, config),
+    ]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(write_shard, tasks))
+    else:
+        results = [write_shard(task) for task in tasks]
+
+    for table, shard, rows in results:
+        log.debug(f"{table} shard {shard}: {rows} rows")
+    log.success(f"Generated {users} users, {positions} positions, {applications} applications in {out_dir}")
+
 
 if __name__ == "__main__":
-    create_mock_users(50)
-    create_mock_positions(25)
-    create_mock_applications(100)
-    
-    print(len(users_data))
-    print(len(positions_data))
-    print(len(applications_data))
-    print(len(stages_data))
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate mock data. With --out, writes sharded NDJSON/CSV at any size.")
+    parser.add_argument("--out", help="output directory for sharded files")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--positions", type=int, default=25)
+    parser.add_argument("--applications", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    args = parser.parse_args()
+
+    if args.out:
+        generate_dataset(args.out, args.users, args.positions, args.applications, args.seed, args.shards, args.workers, args.format)
+    else:
+        create_mock_users(args.users)
+        create_mock_positions(args.positions)
+        create_mock_applications(args.applications)
+        
+        print(len(users_data))
+        print(len(positions_data))
+        print(len(applications_data))
+        print(len(stages_data))
\ No newline at end of file
@@ -1,25 +1,24 @@
-
 import os
 import json
 from dotenv import load_dotenv
 from pathlib import Path
 
 from fastapi import FastAPI
-from sqlmodel import SQLModel, Session, create_engine
-from models import Application, DepartmentEnum, Position, PositionStatusEnum, Stage, User
+from sqlmodel import SQLModel
+from db_utils import create_db_engine
+from bulk_loader import load_file
 from loguru import logger as log
 load_dotenv(dotenv_path=Path(".env"))
 
 app = FastAPI()
 # Load JSON data from the file
 def load_data(file_path: str):
-    print
     with open(file_path, "r") as file:
         return json.load(file)
 
 #----------------------Database connection-----------------------------
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL, echo=True)
+engine = create_db_engine(DATABASE_URL, name="mock_inserter")
 
 # Initialize Faker
 USERS_MOCK_DATA=os.getenv("USERS_MOCK_DATA")
@@ -29,72 +28,24 @@ STAGES_MOCK_DATA=os.getenv("STAGES_MOCK_DATA")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 
-#using fastapi dependency
+# the mock files can be JSON arrays, NDJSON or CSV; see bulk_loader.py
 def insert_mock_users():
     log.critical("----------------------------Inserting Users----------------------------")
-    data = load_data(USERS_MOCK_DATA)
-    with Session(engine) as db:
-        for user in data:
-            new_user = User(
-                id=user.get("id"),
-                name=user.get("name"),
-                email=user.get("email"),
-                hashed_password=user.get("hashed_password"),
-            )
-            db.add(new_user)
-        db.commit()
+    load_file(engine, "users", USERS_MOCK_DATA)
 
 def insert_mock_positions():
     log.critical("----------------------------Inserting Positions----------------------------")
-    data = load_data(POSITIONS_MOCK_DATA)
-    with Session(engine) as db:
-        for position in data:
-            log.debug(position)
-            new_position = Position(
-                id=position.get("id"),
-                title=position.get("title"),
-                department=DepartmentEnum(position.get("department")),
-                status=PositionStatusEnum(position.get("status")),
-                created_at=position.get("created_at"),
-            )
-            log.debug(new_position)
-            db.add(new_position)
-        db.commit()
+    load_file(engine, "positions", POSITIONS_MOCK_DATA)
 
 
 def insert_mock_applications():
     log.critical("----------------------------Inserting Applications----------------------------")
-    data = load_data(APPLICATIONS_MOCK_DATA)
-    with Session(engine) as db:
-        for application in data:
-            print(application)
-            new_application = Application(
-                candidate_id=application.get("candidate_id"),
-                position_id=application.get("position_id"),
-                applied_at=application.get("applied_at"),
-                last_updated=application.get("last_updated"),
-                status=application.get("status"),
-                last_stage_name=application.get("last_stage_name"),
-            )
-            db.add(new_application)
-        db.commit()
+    load_file(engine, "applications", APPLICATIONS_MOCK_DATA, update_rollups=False)
 
         
 def insert_mock_stages():
     log.critical("----------------------------Inserting Stages----------------------------")
-    data = load_data(STAGES_MOCK_DATA)
-    with Session(engine) as db:
-        for stage in data:
-            new_stage = Stage(
-                stage_name=stage.get("stage_name"),
-                candidate_id=stage.get("candidate_id"),
-                position_id=stage.get("position_id"),
-                status=stage.get("status"),
-                feedback=stage.get("feedback"),
-                conducted_at=stage.get("conducted_at"),
-            )
-            db.add(new_stage)
-        db.commit()
+    load_file(engine, "hiring_stages", STAGES_MOCK_DATA)
 
         
 if __name__ =="__main__":
@@ -1,6 +1,7 @@
-from datetime import datetime
+from datetime import date, datetime
 from enum import Enum
 from typing import Optional
+from sqlalchemy import Index, text
 from sqlmodel import Field, Relationship, SQLModel
 
 
@@ -49,6 +50,19 @@ class DepartmentEnum(str, Enum):
 # Application Table
 class Application(SQLModel, table=True):
     __tablename__ = "applications"
+    __table_args__ = (
+        # dashboard KPIs: position IN-list + applied_at range, grouped by status / day
+        Index("ix_applications_position_applied", "position_id", "applied_at", postgresql_include=["status", "last_updated"]),
+        # same, when no position filter is given
+        Index("ix_applications_applied_at", "applied_at", postgresql_include=["position_id", "status"]),
+        # /dashboard/delta/: rows changed since the client's watermark
+        Index("ix_applications_last_updated", "last_updated"),
+        # time-to-hire only looks at accepted applications
+        Index(
+            "ix_applications_accepted_position_last_updated", "position_id", "last_updated",
+            postgresql_include=["applied_at"], postgresql_where=text("status = 'ACCEPTED'"),
+        ),
+    )
     
     candidate_id: int = Field(foreign_key="users.id", primary_key=True)
     position_id: int = Field(foreign_key="positions.id", primary_key=True)
@@ -79,6 +93,9 @@ class User(SQLModel, table=True):
 
 class Position(SQLModel, table=True):
     __tablename__ = "positions"
+    __table_args__ = (
+        Index("ix_positions_department", "department", "id", postgresql_include=["title"]),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str = Field(max_length=100)
@@ -96,6 +113,10 @@ class Position(SQLModel, table=True):
 # Hiring Stages Table
 class Stage(SQLModel, table=True):
     __tablename__ = "hiring_stages"
+    __table_args__ = (
+        Index("ix_hiring_stages_position_conducted", "position_id", "conducted_at", "stage_name"),
+        Index("ix_hiring_stages_conducted_at", "conducted_at", postgresql_include=["position_id", "stage_name"]),
+    )
     
     stage_name: HiringStageNameEnum = Field(primary_key=True)
     candidate_id: int = Field(foreign_key="users.id", primary_key=True)
@@ -106,4 +127,62 @@ class Stage(SQLModel, table=True):
     conducted_at: datetime
     
     def __repr__(self):
-        return f"Stage(stage_name={self.stage_name}, candidate_id={self.candidate_id}, position_id={self.position_id}, status={self.status}, feedback={self.feedback}, conducted_at={self.conducted_at})"
\ No newline at end of file
+        return f"Stage(stage_name={self.stage_name}, candidate_id={self.candidate_id}, position_id={self.position_id}, status={self.status}, feedback={self.feedback}, conducted_at={self.conducted_at})"
+
+
+# Daily rollups, kept in step with applications / hiring_stages by rollups.py
+class ApplicationDailyRollup(SQLModel, table=True):
+    __tablename__ = "application_daily_rollups"
+
+    position_id: int = Field(foreign_key="positions.id", primary_key=True)
+    department: DepartmentEnum = Field(primary_key=True)
+    day: date = Field(primary_key=True)  # day of applied_at
+    status: ApplicationStatusEnum = Field(primary_key=True)
+
+    application_count: int = Field(default=0)
+    hire_days_sum: float = Field(default=0)  # sum of (last_updated - applied_at) in days, ACCEPTED only
+
+    def __repr__(self):
+        return f"ApplicationDailyRollup(position_id={self.position_id}, department={self.department}, day={self.day}, status={self.status}, application_count={self.application_count}, hire_days_sum={self.hire_days_sum})"
+
+
+class StageDailyRollup(SQLModel, table=True):
+    __tablename__ = "stage_daily_rollups"
+
+    position_id: int = Field(foreign_key="positions.id", primary_key=True)
+    department: DepartmentEnum = Field(primary_key=True)
+    day: date = Field(primary_key=True)  # day of conducted_at
+    stage_name: HiringStageNameEnum = Field(primary_key=True)
+
+    stage_count: int = Field(default=0)
+
+    def __repr__(self):
+        return f"StageDailyRollup(position_id={self.position_id}, department={self.department}, day={self.day}, stage_name={self.stage_name}, stage_count={self.stage_count})"
+
+
+# Time-to-hire quantile sketch (see sketches.py): accepted applications per position, day of
+# applied_at and duration bucket
+class HireTimeSketch(SQLModel, table=True):
+    __tablename__ = "hire_time_sketches"
+
+    position_id: int = Field(foreign_key="positions.id", primary_key=True)
+    department: DepartmentEnum = Field(primary_key=True)
+    day: date = Field(primary_key=True)  # day of applied_at
+    bucket: int = Field(primary_key=True)  # sketches.bucket_index of (last_updated - applied_at) in days
+
+    application_count: int = Field(default=0)
+
+    def __repr__(self):
+        return f"HireTimeSketch(position_id={self.position_id}, department={self.department}, day={self.day}, bucket={self.bucket}, application_count={self.application_count})"
+
+
+# Changes the last_updated / conducted_at watermarks can't see (deletes, bulk loads, back-dated
+# writes) move this forward; /dashboard/delta/ answers with a full payload across it
+class IngestWatermark(SQLModel, table=True):
+    __tablename__ = "ingest_watermarks"
+
+    name: str = Field(primary_key=True)
+    updated_at: datetime
+
+    def __repr__(self):
+        return f"IngestWatermark(name={self.name}, updated_at={self.updated_at})"
@@ -0,0 +1,214 @@
+"""Monthly range partitioning of applications (by applied_at) and hiring_stages (by conducted_at)
+on PostgreSQL.
+
+`python partitions.py migrate` moves an existing plain table to the partitioned layout in one
+transaction, writes blocked for its duration:
+  1. it renames the table and its indexes out of the way (*_unpartitioned);
+  2. it creates the partitioned table from the models.py definition;
+  3. it adds a partition for each month from the oldest row to PARTITION_MONTHS_AHEAD months
+     ahead, plus a DEFAULT partition for anything outside them;
+  4. it copies the rows and builds the models.py indexes on the parent, which cascade to every
+     partition;
+  5. it drops the old table (keep it with --keep-old).
+
+A partitioned table's primary key has to include the partition column, so the database key
+becomes (candidate_id, position_id, applied_at) / (stage_name, candidate_id, position_id,
+conducted_at), and the database no longer enforces the models.py key on its own. The ORM
+keeps identifying rows by that key; POST /ingest/ keeps it unique by deleting a row by that
+key before writing it again (see ingest.upsert_rows).
+
+Future months are added by `python partitions.py maintain` (cron it) and by the API, which
+checks every PARTITION_CHECK_HOURS. A row past the last partition lands in DEFAULT;
+creating its month's partition later moves it across.
+
+On other databases every function here does nothing.
+"""
+import argparse
+import asyncio
+import os
+from datetime import date, datetime
+
+from dotenv import load_dotenv
+from pathlib import Path
+from loguru import logger as log
+from sqlalchemy import MetaData, PrimaryKeyConstraint, text
+from sqlalchemy.schema import CreateTable
+from sqlmodel import SQLModel
+
+from db_utils import create_db_engine
+
+import models  # noqa: F401  registers every table on SQLModel.metadata
+
+load_dotenv(dotenv_path=Path(".env"))
+
+# table -> partition column
+PARTITIONED_TABLES = {
+    "applications": "applied_at",
+    "hiring_stages": "conducted_at",
+}
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_CHECK_HOURS = float(os.getenv("PARTITION_CHECK_HOURS", "24"))
+
+# concurrent maintainers (one per API worker) take turns
+_ADVISORY_LOCK_KEY = 0x7061727473
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table_name: str, month: date) -> str:
+    return f"{table_name}_p{month:%Y_%m}"
+
+
+def is_partitioned(connection, table_name: str) -> bool:
+    return connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :table_name AND pg_table_is_visible(c.oid))"
+    ), {"table_name": table_name}).scalar()
+
+
+def existing_partitions(connection, table_name: str) -> set:
+    return set(connection.execute(text(
+        "SELECT child.relname FROM pg_inherits i "
+        "JOIN pg_class child ON child.oid = i.inhrelid JOIN pg_class parent ON parent.oid = i.inhparent "
+        "WHERE parent.relname = :table_name AND pg_table_is_visible(parent.oid)"
+    ), {"table_name": table_name}).scalars())
+
+
+def create_month_partition(connection, table_name: str, column: str, month: date):
+    name, default = partition_name(table_name, month), f"{table_name}_default"
+    bounds = {"lower": month, "upper": add_months(month, 1)}
+    in_month = f'"{column}" >= :lower AND "{column}" < :upper'
+    values = f"FOR VALUES FROM ('{bounds['lower']}') TO ('{bounds['upper']}')"
+
+    stranded = connection.execute(text(f'SELECT EXISTS (SELECT 1 FROM "{default}" WHERE {in_month})'), bounds).scalar()
+    if not stranded:
+        connection.execute(text(f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table_name}" {values}'))
+        return
+
+    # PostgreSQL won't add a partition whose rows are sitting in DEFAULT: move them over first
+    log.info(f"Moving {table_name} rows for {month:%Y-%m} out of {default}")
+    connection.execute(text(f'CREATE TABLE "{name}" (LIKE "{table_name}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    connection.execute(text(
+        f'WITH moved AS (DELETE FROM "{default}" WHERE {in_month} RETURNING *) INSERT INTO "{name}" SELECT * FROM moved'
+    ), bounds)
+    connection.execute(text(f'ALTER TABLE "{table_name}" ATTACH PARTITION "{name}" {values}'))
+
+
+def _create_partitions(connection, table_name: str, column: str, first: date, last: date):
+    existing = existing_partitions(connection, table_name)
+    created = []
+    month = first
+    while month <= last:
+        if partition_name(table_name, month) not in existing:
+            create_month_partition(connection, table_name, column, month)
+            created.append(partition_name(table_name, month))
+        month = add_months(month, 1)
+    return created
+
+
+def ensure_partitions(engine, months_ahead: int = PARTITION_MONTHS_AHEAD) -> list:
+    """Creates any missing partition from this month to months_ahead months out."""
+    if engine.dialect.name != "postgresql":
+        return []
+    this_month = month_start(datetime.utcnow())
+    created = []
+    with engine.begin() as connection:
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+        for table_name, column in PARTITIONED_TABLES.items():
+            if is_partitioned(connection, table_name):
+                created += _create_partitions(connection, table_name, column, this_month, add_months(this_month, months_ahead))
+    if created:
+        log.info(f"Created partitions {', '.join(created)}")
+    return created
+
+
+async def partition_maintainer(engine, interval_hours: float = PARTITION_CHECK_HOURS):
+    while True:
+        try:
+            await asyncio.to_thread(ensure_partitions, engine)
+        except Exception as error:
+            # DEFAULT takes the rows meanwhile, nothing is lost
+            log.error(f"Partition maintenance failed: {error}")
+        await asyncio.sleep(interval_hours * 3600)
+
+
+#----------------------Migration-----------------------------
+def partitioned_table(table_name: str, column: str):
+    """The models.py table, partitioned by RANGE (column) with column added to its primary key."""
+    metadata = MetaData()
+    for table in SQLModel.metadata.sorted_tables:
+        # the whole schema, so foreign keys to users / positions resolve
+        table.to_metadata(metadata)
+    table = metadata.tables[table_name]
+    table.c[column].primary_key = True
+    table.c[column].nullable = False
+    # replaces the copied key rather than adding a second one
+    table.append_constraint(PrimaryKeyConstraint(*(c for c in table.columns if c.primary_key)))
+    table.dialect_kwargs["postgresql_partition_by"] = f'RANGE ("{column}")'
+    return table
+
+
+def migrate_table(connection, table_name: str, column: str, keep_old: bool = False):
+    old = f"{table_name}_unpartitioned"
+    missing = connection.execute(text(f'SELECT count(*) FROM "{table_name}" WHERE "{column}" IS NULL')).scalar()
+    if missing:
+        raise RuntimeError(f"{missing} {table_name} rows have no {column}; set it before partitioning")
+
+    connection.execute(text(f'LOCK TABLE "{table_name}" IN ACCESS EXCLUSIVE MODE'))
+    connection.execute(text(f'ALTER TABLE "{table_name}" RENAME TO "{old}"'))
+    # index (and primary key constraint) names are schema-wide, the new table reuses them
+    for index_name in connection.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = :table_name AND schemaname = current_schema()"
+    ), {"table_name": old}).scalars():
+        connection.execute(text(f'ALTER INDEX "{index_name}" RENAME TO "{index_name[:48]}_unpartitioned"'))
+
+    table = partitioned_table(table_name, column)
+    connection.execute(CreateTable(table))
+    connection.execute(text(f'CREATE TABLE "{table_name}_default" PARTITION OF "{table_name}" DEFAULT'))
+    oldest, newest = connection.execute(text(f'SELECT min("{column}"), max("{column}") FROM "{old}"')).one()
+    this_month = month_start(datetime.utcnow())
+    first = month_start(oldest) if oldest else this_month
+    last = add_months(max(month_start(newest) if newest else this_month, this_month), PARTITION_MONTHS_AHEAD)
+    created = _create_partitions(connection, table_name, column, first, last)
+
+    columns = ", ".join(f'"{name}"' for name in table.columns.keys())
+    copied = connection.execute(text(f'INSERT INTO "{table_name}" ({columns}) SELECT {columns} FROM "{old}"')).rowcount
+    # after the copy, as one bulk build per partition
+    for index in table.indexes:
+        index.create(connection)
+    if not keep_old:
+        connection.execute(text(f'DROP TABLE "{old}"'))
+    connection.execute(text(f'ANALYZE "{table_name}"'))
+    log.success(f"Partitioned {table_name}: {copied} rows into {len(created)} monthly partitions")
+
+
+def migrate(engine, keep_old: bool = False):
+    if engine.dialect.name != "postgresql":
+        log.warning(f"Partitioning needs PostgreSQL, not {engine.dialect.name}; nothing to do")
+        return
+    for table_name, column in PARTITIONED_TABLES.items():
+        with engine.begin() as connection:
+            if is_partitioned(connection, table_name):
+                log.info(f"{table_name} is already partitioned")
+                continue
+            migrate_table(connection, table_name, column, keep_old)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["migrate", "maintain"])
+    parser.add_argument("--keep-old", action="store_true", help="keep the unpartitioned tables as *_unpartitioned")
+    parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    args = parser.parse_args()
+
+    engine = create_db_engine(os.getenv("DATABASE_URL"), name="partitions")
+    if args.command == "migrate":
+        migrate(engine, args.keep_old)
+    ensure_partitions(engine, args.months_ahead)
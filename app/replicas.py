@@ -0,0 +1,139 @@
+"""Routes the read-only KPI queries to read replicas, writes stay on the primary.
+
+DATABASE_REPLICA_URLS lists the replicas (comma separated, same form as DATABASE_URL).
+Requests take them round-robin, skipping any whose last health check failed or whose
+replication lag is over REPLICA_MAX_LAG_SECONDS; with none left they read from the primary.
+A replica that fails mid-request is marked down and the request is retried on the primary.
+
+Two SQLite files stand in for a primary and a replica when testing (lag is always 0 there):
+
+    DATABASE_URL=sqlite:///primary.db DATABASE_REPLICA_URLS=sqlite:///replica.db uvicorn main:app
+"""
+import asyncio
+import itertools
+import os
+import time
+
+from dotenv import load_dotenv
+from pathlib import Path
+from loguru import logger as log
+from sqlalchemy import text
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from db_utils import create_async_db_engine, to_async_url
+
+load_dotenv(dotenv_path=Path(".env"))
+
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "30"))
+REPLICA_HEALTH_INTERVAL_SECONDS = float(os.getenv("REPLICA_HEALTH_INTERVAL_SECONDS", "10"))
+REPLICA_HEALTH_TIMEOUT_SECONDS = float(os.getenv("REPLICA_HEALTH_TIMEOUT_SECONDS", "2"))
+
+# 0 when every received WAL record is replayed, else the age of the last replayed transaction
+# (which on its own overstates lag while the primary is idle)
+POSTGRES_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+# errors that say the database went away rather than that the query was wrong
+CONNECTION_ERRORS = (OperationalError, InterfaceError, OSError, asyncio.TimeoutError)
+
+
+class ReadTarget:
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self.session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        self.healthy = True
+        self.lag = 0.0
+        self.checked_at = None
+        self.error = None
+
+    @property
+    def dialect_name(self) -> str:
+        return self.engine.dialect.name
+
+    def status(self):
+        return {"healthy": self.healthy, "lag_seconds": self.lag, "checked_at": self.checked_at, "error": self.error}
+
+
+class ReplicaRouter:
+    def __init__(self, primary: ReadTarget, replicas: list, max_lag: float = REPLICA_MAX_LAG_SECONDS):
+        self.primary = primary
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self._next = itertools.count()
+
+    @classmethod
+    def from_urls(cls, primary_engine, urls=DATABASE_REPLICA_URLS):
+        replicas = [
+            ReadTarget(f"replica_{i}", create_async_db_engine(to_async_url(url), name=f"replica_{i}"))
+            for i, url in enumerate(urls)
+        ]
+        return cls(ReadTarget("primary", primary_engine), replicas)
+
+    def usable(self, target: ReadTarget) -> bool:
+        return target.healthy and target.lag <= self.max_lag
+
+    def choose(self) -> ReadTarget:
+        """The next usable replica round-robin, else the primary."""
+        if self.replicas:
+            start = next(self._next)
+            for offset in range(len(self.replicas)):
+                target = self.replicas[(start + offset) % len(self.replicas)]
+                if self.usable(target):
+                    return target
+        return self.primary
+
+    def mark_down(self, target: ReadTarget, error):
+        target.healthy = False
+        target.error = str(error)
+        log.warning(f"Read replica {target.name} marked down: {error}")
+
+    async def run(self, target: ReadTarget, work):
+        """await work(target), once more on the primary if a replica's connection fails."""
+        try:
+            return await work(target)
+        except CONNECTION_ERRORS as error:
+            if target is self.primary:
+                raise
+            self.mark_down(target, error)
+            return await work(self.primary)
+
+    #----------------------Health checks-----------------------------
+    async def _measure_lag(self, target: ReadTarget) -> float:
+        async with target.engine.connect() as connection:
+            if target.dialect_name == "postgresql":
+                return float((await connection.execute(POSTGRES_LAG_SQL)).scalar() or 0)
+            await connection.execute(text("SELECT 1"))
+            return 0.0
+
+    async def check(self, target: ReadTarget):
+        try:
+            target.lag = await asyncio.wait_for(self._measure_lag(target), REPLICA_HEALTH_TIMEOUT_SECONDS)
+        except CONNECTION_ERRORS as error:
+            if target.healthy:
+                self.mark_down(target, error)
+        else:
+            if not target.healthy:
+                log.info(f"Read replica {target.name} is back")
+            target.healthy, target.error = True, None
+            if target.lag > self.max_lag:
+                log.warning(f"Read replica {target.name} is {target.lag:.1f}s behind, reading from others")
+        target.checked_at = time.time()
+
+    async def monitor(self, interval: float = REPLICA_HEALTH_INTERVAL_SECONDS):
+        while True:
+            await asyncio.gather(*(self.check(target) for target in self.replicas))
+            await asyncio.sleep(interval)
+
+    def status(self):
+        return {target.name: {**target.status(), "usable": self.usable(target)} for target in self.replicas}
+
+    async def dispose(self):
+        for target in self.replicas:
+            await target.engine.dispose()
@@ -0,0 +1,153 @@
+"""Response encoding for the large dashboard payloads: orjson, gzip / brotli negotiation and
+ETag revalidation. Encoded bodies are memoized per (ETag, encoding), so a cache hit on the
+KPIs doesn't pay for serializing and compressing the same several MB again.
+
+A dashboard's ETag is a hash of its JSON body (see versioned), so it changes exactly when
+the data does, whichever worker or cache entry computed it.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+
+import orjson
+from dotenv import load_dotenv
+from pathlib import Path
+from fastapi import Response, status
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+load_dotenv(dotenv_path=Path(".env"))
+
+RESPONSE_MIN_COMPRESS_BYTES = int(os.getenv("RESPONSE_MIN_COMPRESS_BYTES", "1024"))
+RESPONSE_ENCODED_CACHE_SIZE = int(os.getenv("RESPONSE_ENCODED_CACHE_SIZE", "16"))
+# gzip 6 / brotli 5 trade a little size for a lot of CPU against the maximum levels
+GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "5"))
+
+# the client must revalidate every time, which with an ETag is a cheap 304
+CACHE_CONTROL = "private, no-cache"
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError
+
+
+def dumps(value) -> bytes:
+    # position ids are int keys; jsonable_encoder used to stringify them, orjson needs telling
+    return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def negotiate_encoding(accept_encoding: str):
+    offered = {}
+    for part in (accept_encoding or "").lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        offered[coding.strip()] = quality
+    for coding in ("br", "gzip"):
+        if coding == "br" and brotli is None:
+            continue
+        if offered.get(coding, 0) > 0:
+            return coding
+    return None
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def _variant_etag(etag: str, encoding) -> str:
+    # one representation per content-coding, each with its own strong validator
+    return etag if encoding is None else f'{etag[:-1]}-{encoding}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match uses weak comparison; any content-coding of the same data counts."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    variants = {_variant_etag(etag, encoding) for encoding in (None, "gzip", "br")}
+    return any(
+        candidate.strip().removeprefix("W/") in variants
+        for candidate in if_none_match.split(",")
+    )
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Accept-Encoding"})
+
+
+class EncodedBodies:
+    """Small LRU of encoded response bodies keyed by (etag, content-coding)."""
+
+    def __init__(self, max_entries: int = RESPONSE_ENCODED_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, etag: str, encoding, body: bytes):
+        with self._lock:
+            self._entries[(etag, encoding)] = body
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_encode(self, etag: str, encoding, value):
+        key = (etag, encoding)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        if encoding is None:
+            body = dumps(value)
+        else:
+            body = _compress(self.get_or_encode(etag, None, value), encoding)
+
+        self.put(etag, encoding, body)
+        return body
+
+
+encoded_bodies = EncodedBodies()
+
+
+def versioned(dashboard) -> dict:
+    """{"etag", "dashboard"}: the ETag is a hash of the encoded body, which is kept for the response."""
+    body = dumps(dashboard)
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    encoded_bodies.put(etag, None, body)
+    return {"etag": etag, "dashboard": dashboard}
+
+
+def prefill_encoded(value, etag: str):
+    """Encodes value in every content-coding json_response could pick, ahead of the first request."""
+    identity = encoded_bodies.get_or_encode(etag, None, value)
+    if len(identity) >= RESPONSE_MIN_COMPRESS_BYTES:
+        for encoding in ("gzip", "br") if brotli is not None else ("gzip",):
+            encoded_bodies.get_or_encode(etag, encoding, value)
+
+
+def json_response(value, etag: str, accept_encoding: str) -> Response:
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding is not None and len(encoded_bodies.get_or_encode(etag, None, value)) < RESPONSE_MIN_COMPRESS_BYTES:
+        encoding = None
+
+    headers = {"ETag": _variant_etag(etag, encoding), "Cache-Control": CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    body = encoded_bodies.get_or_encode(etag, encoding, value)
+    return Response(content=body, media_type="application/json", headers=headers)
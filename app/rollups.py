@@ -0,0 +1,279 @@
+"""Incremental maintenance and rebuild of the daily rollup tables and time-to-hire sketches.
+
+Writes that go through the ORM keep the rollups in step via mapper events. Bulk/core
+writes bypass those, so they have to call rebuild_rollups for the positions they touched.
+
+    python rollups.py                 # rebuild everything
+    python rollups.py 12 40 41        # rebuild only these position ids
+"""
+import os
+import sys
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from dotenv import load_dotenv
+from pathlib import Path
+from loguru import logger as log
+from sqlalchemy import delete, event, func, insert, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session
+
+from db_utils import create_db_engine
+
+from cache import kpi_cache
+from sketches import bucket_index
+from sql_compat import days_between
+from models import (
+    Application, ApplicationDailyRollup, ApplicationStatusEnum, HireTimeSketch, HiringStageNameEnum, Position, Stage,
+    StageDailyRollup,
+)
+
+load_dotenv(dotenv_path=Path(".env"))
+
+APPLICATION_ROLLUP_FIELDS = ("position_id", "applied_at", "last_updated", "status")
+STAGE_ROLLUP_FIELDS = ("position_id", "conducted_at", "stage_name")
+
+
+def _as_datetime(value):
+    # the mock loaders hand the ORM ISO strings rather than datetimes
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _department(connection, position_id):
+    return connection.execute(select(Position.department).where(Position.id == position_id)).scalar_one()
+
+
+def _upsert_delta(connection, model, key: dict, deltas: dict):
+    _upsert_deltas(connection, model, [{**key, **deltas}], list(key), list(deltas))
+
+
+def _upsert_deltas(connection, model, rows: list, key_names: list, delta_names: list):
+    table = model.__table__
+    dialect_insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=key_names,
+        set_={name: table.c[name] + stmt.excluded[name] for name in delta_names},
+    )
+    connection.execute(stmt)
+
+
+def _application_deltas(values: dict, sign: int, department: str):
+    """(model, key, deltas) of every rollup row one application counts in."""
+    applied_at = _as_datetime(values["applied_at"])
+    last_updated = _as_datetime(values["last_updated"])
+    status = ApplicationStatusEnum(values["status"])
+    hire_days = 0.0
+    if status == ApplicationStatusEnum.ACCEPTED:
+        hire_days = (last_updated - applied_at).total_seconds() / 86400
+        yield (
+            HireTimeSketch,
+            {"position_id": values["position_id"], "department": department, "day": applied_at.date(), "bucket": bucket_index(hire_days)},
+            {"application_count": sign},
+        )
+    yield (
+        ApplicationDailyRollup,
+        {
+            "position_id": values["position_id"],
+            "department": department,
+            "day": applied_at.date(),
+            "status": status,
+        },
+        {"application_count": sign, "hire_days_sum": sign * hire_days},
+    )
+
+
+def _stage_deltas(values: dict, sign: int, department: str):
+    yield (
+        StageDailyRollup,
+        {
+            "position_id": values["position_id"],
+            "department": department,
+            "day": _as_datetime(values["conducted_at"]).date(),
+            "stage_name": HiringStageNameEnum(values["stage_name"]),
+        },
+        {"stage_count": sign},
+    )
+
+
+def _apply_application(connection, values: dict, sign: int):
+    for model, key, deltas in _application_deltas(values, sign, _department(connection, values["position_id"])):
+        _upsert_delta(connection, model, key, deltas)
+
+
+def _apply_stage(connection, values: dict, sign: int):
+    for model, key, deltas in _stage_deltas(values, sign, _department(connection, values["position_id"])):
+        _upsert_delta(connection, model, key, deltas)
+
+
+class RollupDeltas:
+    """Rollup changes summed per rollup row (and sketch bucket) in Python, then written with
+    one multi-row upsert per table and chunk, for batches too big to apply row by row."""
+
+    def __init__(self):
+        # model -> key values -> summed deltas
+        self.totals = defaultdict(lambda: defaultdict(Counter))
+
+    def add(self, deltas):
+        for model, key, changes in deltas:
+            self.totals[model][tuple(key.items())].update(changes)
+
+    def add_application(self, values: dict, sign: int, department: str):
+        self.add(_application_deltas(values, sign, department))
+
+    def add_stage(self, values: dict, sign: int, department: str):
+        self.add(_stage_deltas(values, sign, department))
+
+    def write(self, connection, chunk_rows: int = 1000):
+        for model, per_key in self.totals.items():
+            # a row moved and moved back nets out to nothing
+            rows = [{**dict(key), **changes} for key, changes in per_key.items() if any(changes.values())]
+            if not rows:
+                continue
+            key_names = [name for name, _ in next(iter(per_key))]
+            delta_names = [name for name in rows[0] if name not in key_names]
+            for start in range(0, len(rows), chunk_rows):
+                _upsert_deltas(connection, model, rows[start:start + chunk_rows], key_names, delta_names)
+
+
+def _current_and_previous(target, fields):
+    """(current, previous) values of fields, or None when none of them changed in this flush."""
+    state = inspect(target)
+    current, previous, changed = {}, {}, False
+    for field in fields:
+        history = state.attrs[field].history
+        current[field] = getattr(target, field)
+        previous[field] = history.deleted[0] if history.deleted else current[field]
+        changed = changed or history.has_changes()
+    return (current, previous) if changed else None
+
+
+#----------------------Mapper events-----------------------------
+@event.listens_for(Application, "after_insert")
+def _application_inserted(mapper, connection, target):
+    _apply_application(connection, {f: getattr(target, f) for f in APPLICATION_ROLLUP_FIELDS}, +1)
+
+
+@event.listens_for(Application, "after_update")
+def _application_updated(mapper, connection, target):
+    values = _current_and_previous(target, APPLICATION_ROLLUP_FIELDS)
+    if values:
+        current, previous = values
+        _apply_application(connection, previous, -1)
+        _apply_application(connection, current, +1)
+
+
+@event.listens_for(Application, "after_delete")
+def _application_deleted(mapper, connection, target):
+    _apply_application(connection, {f: getattr(target, f) for f in APPLICATION_ROLLUP_FIELDS}, -1)
+
+
+@event.listens_for(Stage, "after_insert")
+def _stage_inserted(mapper, connection, target):
+    _apply_stage(connection, {f: getattr(target, f) for f in STAGE_ROLLUP_FIELDS}, +1)
+
+
+@event.listens_for(Stage, "after_update")
+def _stage_updated(mapper, connection, target):
+    values = _current_and_previous(target, STAGE_ROLLUP_FIELDS)
+    if values:
+        current, previous = values
+        _apply_stage(connection, previous, -1)
+        _apply_stage(connection, current, +1)
+
+
+@event.listens_for(Stage, "after_delete")
+def _stage_deleted(mapper, connection, target):
+    _apply_stage(connection, {f: getattr(target, f) for f in STAGE_ROLLUP_FIELDS}, -1)
+
+
+@event.listens_for(Position, "after_update")
+def _position_updated(mapper, connection, target):
+    if not inspect(target).attrs.department.history.has_changes():
+        return
+    for model in (ApplicationDailyRollup, StageDailyRollup, HireTimeSketch):
+        connection.execute(
+            update(model).where(model.position_id == target.id).values(department=target.department)
+        )
+
+
+#----------------------Rebuild-----------------------------
+def _rebuild_sketches(db: Session, position_ids=None):
+    # bucketed here rather than in SQL, so a rebuilt sketch and the incremental updates
+    # agree on the bucket of every duration to the last float bit
+    accepted = (
+        select(Application.position_id, Position.department, Application.applied_at, Application.last_updated)
+        .join(Position, Application.position_id == Position.id)
+        .where(Application.status == ApplicationStatusEnum.ACCEPTED)
+        .execution_options(yield_per=10_000)
+    )
+    if position_ids is not None:
+        accepted = accepted.where(Application.position_id.in_(position_ids))
+
+    counts = Counter()
+    for position_id, department, applied_at, last_updated in db.exec(accepted):
+        hire_days = (last_updated - applied_at).total_seconds() / 86400
+        counts[position_id, department, applied_at.date(), bucket_index(hire_days)] += 1
+
+    rows = [
+        {"position_id": position_id, "department": department, "day": day, "bucket": bucket, "application_count": count}
+        for (position_id, department, day, bucket), count in counts.items()
+    ]
+    if rows:
+        db.exec(insert(HireTimeSketch), params=rows)
+
+
+def rebuild_rollups(db: Session, position_ids=None):
+    """Recomputes the rollups from the raw tables, for every position or only position_ids."""
+    for model in (ApplicationDailyRollup, StageDailyRollup, HireTimeSketch):
+        stmt = delete(model)
+        if position_ids is not None:
+            stmt = stmt.where(model.position_id.in_(position_ids))
+        db.exec(stmt)
+
+    day = func.date(Application.applied_at)
+    applications = (
+        select(
+            Application.position_id,
+            Position.department,
+            day,
+            Application.status,
+            func.count(),
+            func.coalesce(
+                func.sum(days_between(Application.applied_at, Application.last_updated)).filter(Application.status == ApplicationStatusEnum.ACCEPTED), 0
+            ),
+        )
+        .join(Position, Application.position_id == Position.id)
+        .group_by(Application.position_id, Position.department, day, Application.status)
+    )
+    stage_day = func.date(Stage.conducted_at)
+    stages = (
+        select(Stage.position_id, Position.department, stage_day, Stage.stage_name, func.count())
+        .join(Position, Stage.position_id == Position.id)
+        .group_by(Stage.position_id, Position.department, stage_day, Stage.stage_name)
+    )
+    if position_ids is not None:
+        applications = applications.where(Application.position_id.in_(position_ids))
+        stages = stages.where(Stage.position_id.in_(position_ids))
+
+    db.exec(
+        insert(ApplicationDailyRollup).from_select(
+            ["position_id", "department", "day", "status", "application_count", "hire_days_sum"], applications
+        )
+    )
+    db.exec(
+        insert(StageDailyRollup).from_select(
+            ["position_id", "department", "day", "stage_name", "stage_count"], stages
+        )
+    )
+    _rebuild_sketches(db, position_ids)
+    db.commit()
+    kpi_cache.invalidate()
+    log.info(f"Rebuilt daily rollups for {'all' if position_ids is None else len(position_ids)} positions")
+
+
+if __name__ == "__main__":
+    engine = create_db_engine(os.getenv("DATABASE_URL"), name="rollups")
+    ApplicationDailyRollup.metadata.create_all(engine, tables=[ApplicationDailyRollup.__table__, StageDailyRollup.__table__, HireTimeSketch.__table__])
+    with Session(engine) as db:
+        rebuild_rollups(db, [int(arg) for arg in sys.argv[1:]] or None)
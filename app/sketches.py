@@ -0,0 +1,51 @@
+"""Mergeable quantile sketches for time-to-hire, DDSketch style.
+
+A duration of d days is counted in bucket ceil(log_gamma(d)); every value in a bucket is
+within RELATIVE_ACCURACY of the bucket's representative value. Sketches merge by adding
+counts per bucket, so the hire_time_sketches rollup (per position / day / bucket) merges
+over any filter range with a plain SUM ... GROUP BY bucket.
+
+Changing RELATIVE_ACCURACY or MIN_DAYS changes what a stored bucket index means: run
+`python rollups.py` afterwards to rebuild the stored sketches.
+"""
+import math
+from collections import Counter
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+# hires faster than a minute all land in the first bucket
+MIN_DAYS = 1 / 1440
+
+# reported time-to-hire percentiles, {"p50": q=0.5, ...}
+QUANTILES = {"p50": 0.5, "p90": 0.9}
+
+
+def bucket_index(days: float) -> int:
+    return math.ceil(math.log(max(days, MIN_DAYS)) / _LOG_GAMMA)
+
+
+def bucket_value(index: int) -> float:
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+def quantiles(buckets: dict, wanted: dict = QUANTILES) -> dict:
+    """{name: value} for each quantile in wanted, from a {bucket index: count} sketch."""
+    total = sum(buckets.values())
+    if total <= 0:
+        return {name: None for name in wanted}
+
+    ordered = sorted((index, count) for index, count in buckets.items() if count > 0)
+    result = {}
+    for name, q in wanted.items():
+        rank, seen = q * (total - 1), 0
+        for index, count in ordered:
+            seen += count
+            if seen > rank:
+                result[name] = bucket_value(index)
+                break
+    return result
+
+
+def sketch(values) -> Counter:
+    return Counter(bucket_index(value) for value in values)
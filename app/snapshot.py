@@ -0,0 +1,311 @@
+"""In-process columnar snapshot of applications, hiring_stages and positions, an alternative
+to SQL for answering the dashboard KPIs.
+
+Every column is a NumPy array: enums as small integer codes, timestamps as int64
+microseconds. A filter becomes a boolean mask and each group-by a bincount, so a dashboard
+over a million applications takes milliseconds and no database round trip.
+
+The snapshot is reloaded in the background (see SnapshotStore.refresher) once the KPI cache
+has been invalidated by a write, and at least every SNAPSHOT_MAX_AGE_SECONDS for writes made
+by other processes. GET /dashboard/?backend=snapshot (or DASHBOARD_BACKEND=snapshot) reads
+from it; check_snapshot_parity.py compares it against the SQL KPIs.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from dotenv import load_dotenv
+from pathlib import Path
+from loguru import logger as log
+from sqlmodel import Session, select
+
+from filters import RECENT_DAYS, KPIFilter
+from KPIs import OTHER_POSITIONS
+from models import Application, ApplicationStatusEnum, DepartmentEnum, HiringStageNameEnum, Position, Stage
+from sketches import GAMMA, MIN_DAYS, quantiles
+
+load_dotenv(dotenv_path=Path(".env"))
+
+# "sql" or "snapshot": which backend GET /dashboard/ uses when the request doesn't say
+DASHBOARD_BACKEND = os.getenv("DASHBOARD_BACKEND", "sql")
+SNAPSHOT_CHECK_SECONDS = float(os.getenv("SNAPSHOT_CHECK_SECONDS", "5"))
+SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("SNAPSHOT_MAX_AGE_SECONDS", "300"))
+SNAPSHOT_LOAD_CHUNK = int(os.getenv("SNAPSHOT_LOAD_CHUNK", "50000"))
+
+STATUSES = list(ApplicationStatusEnum)
+STAGE_NAMES = list(HiringStageNameEnum)
+DEPARTMENTS = list(DepartmentEnum)
+
+MICROS_PER_DAY = 86_400_000_000
+# NULL timestamps; below every real bound, so range masks drop them like SQL does
+NAT = np.iinfo(np.int64).min
+
+
+def to_micros(value: datetime) -> int:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return int(np.datetime64(value, "us").astype(np.int64))
+
+
+def _timestamps(values) -> np.ndarray:
+    # None becomes NaT, which as int64 is NAT
+    return np.array(values, dtype="datetime64[us]").astype(np.int64)
+
+
+def _codes(values, members: list, dtype=np.int8) -> np.ndarray:
+    index = {member: code for code, member in enumerate(members)}
+    return np.fromiter((index[value] for value in values), dtype=dtype, count=len(values))
+
+
+def _bucket_days(micros: np.ndarray, unit: str) -> np.ndarray:
+    """Days since the epoch of the day / week (Monday) / month each timestamp falls in,
+    the same bucket starts as sql_compat.date_bucket."""
+    days = micros // MICROS_PER_DAY
+    if unit == "week":
+        # 1970-01-01 was a Thursday
+        return days - (days + 3) % 7
+    if unit == "month":
+        return days.astype("datetime64[D]").astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+    return days
+
+
+def _sketch_buckets(days: np.ndarray) -> np.ndarray:
+    # sketches.bucket_index over an array
+    return np.ceil(np.log(np.maximum(days, MIN_DAYS)) / np.log(GAMMA)).astype(np.int64)
+
+
+#----------------------Snapshot-----------------------------
+class Snapshot:
+    """One consistent load of the three tables. Never modified after loading, so requests
+    can read it from any thread while the next one loads."""
+
+    def __init__(self, positions, applications, stages, version: str):
+        self.version = version
+        self.loaded_at = time.time()
+
+        position_ids, titles, departments = positions
+        order = np.argsort(position_ids)
+        self.position_ids = position_ids[order]
+        self.position_departments = departments[order]
+        # titles aren't unique; application_per_job_posting groups by the title
+        self.titles, title_codes = np.unique(np.array(titles, dtype=object)[order], return_inverse=True)
+        self.position_titles = title_codes.reshape(-1)
+
+        # candidate columns are left out: no KPI groups or filters by candidate
+        self.app_positions = np.searchsorted(self.position_ids, applications[0])
+        self.app_applied_at, self.app_last_updated, self.app_status = applications[1:]
+        self.stage_positions = np.searchsorted(self.position_ids, stages[0])
+        self.stage_conducted_at, self.stage_names = stages[1:]
+
+    @property
+    def size(self) -> dict:
+        return {"positions": len(self.position_ids), "applications": len(self.app_status), "hiring_stages": len(self.stage_names)}
+
+    #----------------------Masks-----------------------------
+    def _positions_mask(self, filters: KPIFilter) -> np.ndarray:
+        allowed = np.ones(len(self.position_ids), dtype=bool)
+        if filters.position_ids is not None:
+            allowed &= np.isin(self.position_ids, filters.position_ids)
+        if filters.departments is not None:
+            codes = [code for code, department in enumerate(DEPARTMENTS) if department.value in filters.departments]
+            allowed &= np.isin(self.position_departments, codes)
+        return allowed
+
+    @staticmethod
+    def _range(column: np.ndarray, filters: KPIFilter, lower: bool = True, upper: bool = True) -> np.ndarray:
+        mask = column != NAT
+        if lower and filters.start_date is not None:
+            mask &= column >= to_micros(filters.start_date)
+        if upper and filters.end_date is not None:
+            mask &= column <= to_micros(filters.end_date)
+        return mask
+
+    def applications_mask(self, filters: KPIFilter) -> np.ndarray:
+        return self._positions_mask(filters)[self.app_positions] & self._range(self.app_applied_at, filters)
+
+    def stages_mask(self, filters: KPIFilter) -> np.ndarray:
+        return self._positions_mask(filters)[self.stage_positions] & self._range(self.stage_conducted_at, filters)
+
+    def _accepted(self, filters: KPIFilter):
+        """(department code, days to hire) of the accepted applications, as KPIs._accepted_applications."""
+        mask = (
+            self.applications_mask(filters)
+            & (self.app_status == STATUSES.index(ApplicationStatusEnum.ACCEPTED))
+            & self._range(self.app_last_updated, filters, lower=False)
+        )
+        days = (self.app_last_updated[mask] - self.app_applied_at[mask]) / MICROS_PER_DAY
+        return self.position_departments[self.app_positions[mask]], days
+
+    #----------------------KPIs-----------------------------
+    def all_positions(self) -> dict:
+        return {int(id): self.titles[title] for id, title in zip(self.position_ids, self.position_titles)}
+
+    def status_counts(self, filters: KPIFilter) -> dict:
+        counts = np.bincount(self.app_status[self.applications_mask(filters)], minlength=len(STATUSES))
+        return {STATUSES[code]: int(count) for code, count in enumerate(counts) if count}
+
+    def stage_counts(self, filters: KPIFilter) -> dict:
+        counts = np.bincount(self.stage_names[self.stages_mask(filters)], minlength=len(STAGE_NAMES))
+        return {STAGE_NAMES[code]: int(count) for code, count in enumerate(counts) if count}
+
+    def time_to_hire(self, filters: KPIFilter) -> dict:
+        departments, days = self._accepted(filters)
+        counts = np.bincount(departments, minlength=len(DEPARTMENTS))
+        sums = np.bincount(departments, weights=days, minlength=len(DEPARTMENTS))
+        return {DEPARTMENTS[code]: float(sums[code] / counts[code]) for code in np.flatnonzero(counts)}
+
+    def time_to_hire_percentiles(self, filters: KPIFilter) -> dict:
+        """From the same sketches as the SQL rollups, so within their relative accuracy of exact."""
+        departments, days = self._accepted(filters)
+        buckets = _sketch_buckets(days)
+        result = {}
+        for code in np.unique(departments):
+            indexes, counts = np.unique(buckets[departments == code], return_counts=True)
+            result[DEPARTMENTS[code]] = quantiles(dict(zip(indexes.tolist(), counts.tolist())))
+        return result
+
+    def recent_count(self, filters: KPIFilter) -> int:
+        recent = to_micros(datetime.utcnow() - timedelta(days=RECENT_DAYS))
+        return int(np.count_nonzero(self.applications_mask(filters) & (self.app_applied_at >= recent)))
+
+    def per_posting(self, filters: KPIFilter) -> dict:
+        mask = self.applications_mask(filters)
+        titles = self.position_titles[self.app_positions[mask]]
+        days = _bucket_days(self.app_applied_at[mask], filters.bucket)
+        if not len(days):
+            return {}
+
+        first_day = days.min()
+        span = int(days.max() - first_day) + 1
+        keys, counts = np.unique(titles * span + (days - first_day), return_counts=True)
+        key_titles, key_days = np.divmod(keys, span)
+
+        names = self.titles[key_titles]
+        if filters.top_positions:
+            # as KPIs.limit_positions: most applications first, ties by title
+            totals = np.bincount(titles, minlength=len(self.titles))
+            present = np.flatnonzero(totals)
+            ranked = present[np.lexsort((present, -totals[present]))]
+            kept = np.isin(key_titles, ranked[:filters.top_positions])
+            names = np.where(kept, names, OTHER_POSITIONS)
+
+        day_names = (key_days + first_day).astype("datetime64[D]").astype(str).tolist()
+        res = defaultdict(dict)
+        for title, day, count in zip(names.tolist(), day_names, counts.tolist()):
+            res[title][day] = res[title].get(day, 0) + count
+        return res
+
+    def kpis(self, filters: KPIFilter) -> dict:
+        """The same dict as dashboard.get_kpis_per_query."""
+        return {
+            "all_positions": self.all_positions(),
+            "status_counts": self.status_counts(filters),
+            "stage_counts": self.stage_counts(filters),
+            "time_to_hire": self.time_to_hire(filters),
+            "time_to_hire_percentiles": self.time_to_hire_percentiles(filters),
+            "recent_count": self.recent_count(filters),
+            "per_posting": self.per_posting(filters),
+        }
+
+
+#----------------------Loading-----------------------------
+def _load_columns(db: Session, stmt, convert):
+    """Reads stmt SNAPSHOT_LOAD_CHUNK rows at a time, converting each chunk's columns to arrays."""
+    chunks = []
+    result = db.exec(stmt.execution_options(yield_per=SNAPSHOT_LOAD_CHUNK))
+    for rows in result.partitions():
+        chunks.append(convert(list(zip(*rows))))
+    if not chunks:
+        chunks.append(convert([[]] * len(stmt.selected_columns)))
+    return tuple(np.concatenate(column) for column in zip(*chunks))
+
+
+def load_snapshot(db: Session, version: str = "") -> Snapshot:
+    started = time.perf_counter()
+    # one transaction, so the three tables are read at the same point on PostgreSQL
+    with db.begin():
+        positions = _load_columns(
+            db, select(Position.id, Position.title, Position.department),
+            lambda c: (np.array(c[0], dtype=np.int64), np.array(c[1], dtype=object), _codes(c[2], DEPARTMENTS)),
+        )
+        applications = _load_columns(
+            db, select(Application.position_id, Application.applied_at, Application.last_updated, Application.status),
+            lambda c: (np.array(c[0], dtype=np.int64), _timestamps(c[1]), _timestamps(c[2]), _codes(c[3], STATUSES)),
+        )
+        stages = _load_columns(
+            db, select(Stage.position_id, Stage.conducted_at, Stage.stage_name),
+            lambda c: (np.array(c[0], dtype=np.int64), _timestamps(c[1]), _codes(c[2], STAGE_NAMES)),
+        )
+    snapshot = Snapshot(positions, applications, stages, version)
+    log.info(f"Loaded KPI snapshot {snapshot.size} in {time.perf_counter() - started:.2f}s")
+    return snapshot
+
+
+class SnapshotStore:
+    """Holds the current snapshot and replaces it when the KPI cache's generation moves on."""
+
+    def __init__(self, engine, cache):
+        self.engine = engine
+        self.cache = cache
+        self.snapshot = None
+        self._generation = None
+        self._loads = 0
+        self._lock = asyncio.Lock()
+        self._instance = os.urandom(4).hex()
+        self._load_lock = threading.Lock()
+        self._refresher = None
+
+    def _load(self) -> Snapshot:
+        with self._load_lock:
+            # read before loading: a write committed during the load triggers another one
+            generation = self.cache.generation
+            self._loads += 1
+            with Session(self.engine) as db:
+                snapshot = load_snapshot(db, version=f"s{self._instance}.{self._loads}")
+            self.snapshot, self._generation = snapshot, generation
+            return snapshot
+
+    def stale(self) -> bool:
+        return (
+            self.snapshot is None
+            or self.cache.generation != self._generation
+            or time.time() - self.snapshot.loaded_at > SNAPSHOT_MAX_AGE_SECONDS
+        )
+
+    async def refresh(self) -> Snapshot:
+        async with self._lock:
+            return await asyncio.to_thread(self._load)
+
+    async def get(self) -> Snapshot:
+        """The current snapshot; only the very first call waits for a load, and starts the
+        background refresher."""
+        if self.snapshot is None:
+            async with self._lock:
+                if self.snapshot is None:
+                    await asyncio.to_thread(self._load)
+                    self._refresher = asyncio.create_task(self.refresher())
+        return self.snapshot
+
+    async def refresher(self, interval: float = SNAPSHOT_CHECK_SECONDS):
+        while True:
+            # the generation is a blocking Redis GET with the shared backend
+            if await asyncio.to_thread(self.stale):
+                try:
+                    await self.refresh()
+                except Exception as error:
+                    # keep serving the previous snapshot
+                    log.error(f"KPI snapshot reload failed: {error}")
+            await asyncio.sleep(interval)
+
+    def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+
+    def status(self):
+        if self.snapshot is None:
+            return {"loaded": False}
+        return {"loaded": True, "version": self.snapshot.version, "loaded_at": self.snapshot.loaded_at, "rows": self.snapshot.size, "stale": self.stale()}
@@ -0,0 +1,63 @@
+"""The few date expressions the KPI queries need, rendered per dialect.
+
+PostgreSQL is the real target; the SQLite renderings exist so the KPIs also run against
+the SQLite fallback used by benchmark.py.
+"""
+from sqlalchemy import Date, Float
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.sql.visitors import InternalTraversal
+
+BUCKETS = ("day", "week", "month")
+
+
+class date_bucket(FunctionElement):
+    """The date a timestamp's day / week (from Monday) / month starts on."""
+    type = Date()
+    inherit_cache = True
+    name = "date_bucket"
+    # the unit is rendered inline, so it has to be part of the compiled-statement cache key
+    _traverse_internals = FunctionElement._traverse_internals + [("unit", InternalTraversal.dp_string)]
+
+    def __init__(self, unit: str, column, **kw):
+        if unit not in BUCKETS:
+            raise ValueError(f"Unknown bucket {unit!r}, expected one of {BUCKETS}")
+        self.unit = unit
+        super().__init__(column, **kw)
+
+
+class days_between(FunctionElement):
+    """(end - start) in fractional days."""
+    type = Float()
+    inherit_cache = True
+    name = "days_between"
+
+
+@compiles(date_bucket)
+def _date_bucket(element, compiler, **kw):
+    return "CAST(date_trunc('%s', %s) AS DATE)" % (element.unit, compiler.process(element.clauses, **kw))
+
+
+_SQLITE_BUCKET_MODIFIERS = {
+    "day": "",
+    "week": ", 'weekday 0', '-6 days'",  # the Sunday on/after, back to its Monday
+    "month": ", 'start of month'",
+}
+
+
+@compiles(date_bucket, "sqlite")
+def _date_bucket_sqlite(element, compiler, **kw):
+    return "date(" + compiler.process(element.clauses, **kw) + _SQLITE_BUCKET_MODIFIERS[element.unit] + ")"
+
+
+@compiles(days_between)
+def _days_between(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return "CAST(EXTRACT(epoch FROM %s - %s) / 86400 AS FLOAT)" % (compiler.process(end, **kw), compiler.process(start, **kw))
+
+
+@compiles(days_between, "sqlite")
+def _days_between_sqlite(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return "(julianday(%s) - julianday(%s))" % (compiler.process(end, **kw), compiler.process(start, **kw))
+
@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+import jwt
+import pytest
+
+import auth
+
+
+@pytest.fixture
+def east_of_utc(monkeypatch):
+    # cached tokens used to outlive their exp by the UTC offset here
+    monkeypatch.setenv("TZ", "Asia/Kolkata")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.fixture
+def secret(monkeypatch):
+    monkeypatch.setattr(auth, "SECRET_KEY", "test-secret")
+    monkeypatch.setattr(auth, "ALGORITHM", "HS256")
+
+
+def test_cached_token_expires_at_exp(east_of_utc, secret):
+    token = jwt.encode({"sub": "u@x.com", "exp": int(time.time()) + 1}, "test-secret", algorithm="HS256")
+    assert auth.verify_access_token(token)["sub"] == "u@x.com"
+    time.sleep(2)
+    assert auth.verify_access_token(token) is None
+
+
+def test_created_token_verifies(east_of_utc, secret, monkeypatch):
+    monkeypatch.setattr(auth, "ACCESS_TOKEN_EXPIRE_MINUTES", "5")
+    token = auth.create_access_token({"sub": "u@x.com"})
+    assert auth.verify_access_token(token)["sub"] == "u@x.com"
+    # served from the cache the second time
+    assert auth.verify_access_token(token)["sub"] == "u@x.com"
+
+
+def test_hashing_beyond_the_pool_bound_is_rejected(monkeypatch):
+    monkeypatch.setattr(auth, "_hash_in_flight", auth.AUTH_HASH_WORKERS + auth.AUTH_HASH_MAX_PENDING)
+    with pytest.raises(auth.HashingOverloaded):
+        asyncio.run(auth.hash_password_async("pw"))
+    monkeypatch.setattr(auth, "_hash_in_flight", 0)
+    assert auth.verify_password("pw", asyncio.run(auth.hash_password_async("pw")))
@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime
+
+import orjson
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import rollups  # noqa: F401  keeps the rollups in step with the rows below
+from dashboard import build_dashboard, build_dashboard_delta_async
+from db_utils import create_async_db_engine
+from models import Application, Position, Stage, User
+from responses import dumps
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    path = tmp_path / "dashboard.db"
+    engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as db:
+        # titles a, b, c with 3, 2 and 1 applications
+        for position_id, title in enumerate("abc", start=1):
+            db.add(Position(id=position_id, title=title, department="SALES", status="OPEN"))
+        for candidate_id in range(1, 6):
+            db.add(User(id=candidate_id, name="x", email=f"u{candidate_id}@x.com", hashed_password="h"))
+        db.commit()
+        for position_id, applicants in ((1, 3), (2, 2), (3, 1)):
+            for candidate_id in range(1, applicants + 1):
+                db.add(Application(
+                    candidate_id=candidate_id, position_id=position_id, applied_at=datetime(2024, 1, 1, 10),
+                    last_updated=datetime(2024, 1, 2), status="APPLIED",
+                ))
+        db.add(Stage(stage_name="PHONE_SCREENING", candidate_id=1, position_id=1, status="PASSED", conducted_at=datetime(2024, 1, 3)))
+        db.commit()
+    yield path
+    engine.dispose()
+
+
+def _merge(dashboard: dict, changes: dict):
+    for section, entries in changes.items():
+        for key, value in entries.items():
+            if value is None:
+                dashboard[section].pop(key, None)
+            else:
+                dashboard[section][key] = value
+    return dashboard
+
+
+@pytest.mark.parametrize("top_positions", [None, 1])
+def test_delta_merged_into_full_dashboard_equals_full_dashboard(database_path, top_positions):
+    filters = {"top_positions": top_positions}
+    engine = create_engine(f"sqlite:///{database_path}")
+    with Session(engine) as db:
+        before = orjson.loads(dumps(build_dashboard(db, filters)))
+        since = datetime.utcnow()
+        # b overtakes a, which drops out of the top 1
+        for candidate_id in (3, 4):
+            db.add(Application(candidate_id=candidate_id, position_id=2, applied_at=datetime(2024, 1, 1, 10), last_updated=datetime.utcnow(), status="APPLIED"))
+        # the only PHONE_SCREENING row is renamed away
+        stage = db.exec(select(Stage)).one()
+        stage.stage_name, stage.conducted_at = "TECHNICAL_INTERVIEW_1", datetime.utcnow()
+        db.commit()
+        after = orjson.loads(dumps(build_dashboard(db, filters)))
+    engine.dispose()
+
+    async def delta():
+        async_engine = create_async_db_engine(f"sqlite+aiosqlite:///{database_path}")
+        try:
+            session_factory = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+            return await build_dashboard_delta_async(session_factory, "sqlite", filters, since)
+        finally:
+            await async_engine.dispose()
+
+    changes = orjson.loads(dumps(asyncio.run(delta())))
+    assert "PHONE_SCREENING" not in after["candidate_stage_counts"]
+    assert _merge(before, changes) == after
@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine, select
+
+import rollups  # noqa: F401  keeps the rollups in step with the rows below
+from ingest import IngestBatch, ingest_batch
+from models import Application, ApplicationDailyRollup, HireTimeSketch, Position, Stage, StageDailyRollup, User
+from rollups import rebuild_rollups
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as db:
+        for position_id, department in ((1, "SALES"), (2, "ENGINEERING"), (3, "SALES")):
+            db.add(Position(id=position_id, title=f"p{position_id}", department=department, status="OPEN"))
+        for candidate_id in range(1, 7):
+            db.add(User(id=candidate_id, name="x", email=f"u{candidate_id}@x.com", hashed_password="h"))
+        db.commit()
+        for candidate_id in range(1, 5):
+            db.add(Application(
+                candidate_id=candidate_id, position_id=1, applied_at=datetime(2024, 1, candidate_id, 9),
+                last_updated=datetime(2024, 2, 1), status="ACCEPTED" if candidate_id % 2 else "APPLIED",
+            ))
+            db.add(Stage(
+                stage_name="RESUME_SCREENING", candidate_id=candidate_id, position_id=1, status="PASSED",
+                conducted_at=datetime(2024, 1, 10),
+            ))
+        db.commit()
+        yield db
+
+
+ROLLUP_COUNTS = {ApplicationDailyRollup: "application_count", StageDailyRollup: "stage_count", HireTimeSketch: "application_count"}
+
+
+def _rollups(db):
+    # the incremental path leaves rows counted down to zero behind, a rebuild doesn't
+    return {
+        model.__name__: sorted(
+            tuple(pytest.approx(value) if isinstance(value, float) else value for value in row)
+            for row in db.exec(select(*model.__table__.columns).where(model.__table__.c[count] != 0)).all()
+        )
+        for model, count in ROLLUP_COUNTS.items()
+    }
+
+
+def test_ingest_rollups_match_a_rebuild(db):
+    result = ingest_batch(db, IngestBatch(
+        applications=[
+            # unchanged
+            {"candidate_id": 1, "position_id": 1, "applied_at": "2024-01-01T09:00:00", "last_updated": "2024-02-01T00:00:00", "status": "ACCEPTED"},
+            # accepted, a new sketch bucket
+            {"candidate_id": 2, "position_id": 1, "applied_at": "2024-01-02T09:00:00", "last_updated": "2024-03-15T00:00:00", "status": "ACCEPTED"},
+            # no longer accepted, and moved to another day
+            {"candidate_id": 3, "position_id": 1, "applied_at": "2024-01-20T09:00:00", "last_updated": "2024-02-01T00:00:00", "status": "REJECTED"},
+            # new, a new department, two in the same rollup row
+            {"candidate_id": 5, "position_id": 2, "applied_at": "2024-01-05T09:00:00", "last_updated": "2024-01-25T00:00:00", "status": "ACCEPTED"},
+            {"candidate_id": 6, "position_id": 2, "applied_at": "2024-01-05T12:00:00", "last_updated": "2024-01-25T00:00:00", "status": "ACCEPTED"},
+            # a later event for the same key wins
+            {"candidate_id": 6, "position_id": 3, "applied_at": "2024-01-05T12:00:00", "status": "APPLIED"},
+            {"candidate_id": 6, "position_id": 3, "applied_at": "2024-01-06T12:00:00", "status": "APPLIED"},
+            # rejected: no such position
+            {"candidate_id": 1, "position_id": 99, "applied_at": "2024-01-01T09:00:00", "status": "APPLIED"},
+        ],
+        stages=[
+            {"stage_name": "RESUME_SCREENING", "candidate_id": 1, "position_id": 1, "status": "PASSED", "conducted_at": "2024-01-10T00:00:00"},
+            {"stage_name": "RESUME_SCREENING", "candidate_id": 2, "position_id": 1, "status": "PASSED", "conducted_at": "2024-01-12T00:00:00"},
+            {"stage_name": "TECHNICAL_INTERVIEW_1", "candidate_id": 5, "position_id": 2, "status": "PASSED", "conducted_at": "2024-01-15T00:00:00"},
+        ],
+    ))
+    assert result["accepted"] == {"applications": 6, "stages": 3}
+    assert len(result["rejected"]) == 1
+
+    incremental = _rollups(db)
+    rebuild_rollups(db)
+    assert incremental == _rollups(db)
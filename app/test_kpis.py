@@ -0,0 +1,50 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine
+
+import rollups  # noqa: F401  keeps the rollups in step with the rows below
+from filters import KPIFilter
+from KPIs import OTHER_POSITIONS, application_per_job_posting, dashboard_kpis_stmt
+from models import Application, Position, User
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as db:
+        # titles a, b, c with 3, 2 and 1 applications
+        for position_id, title in enumerate("abc", start=1):
+            db.add(Position(id=position_id, title=title, department="SALES", status="OPEN"))
+        for candidate_id in range(1, 4):
+            db.add(User(id=candidate_id, name="x", email=f"u{candidate_id}@x.com", hashed_password="h"))
+        db.commit()
+        for position_id, applicants in ((1, 3), (2, 2), (3, 1)):
+            for candidate_id in range(1, applicants + 1):
+                db.add(Application(
+                    candidate_id=candidate_id, position_id=position_id, applied_at=datetime(2024, 1, 1, 10),
+                    last_updated=datetime(2024, 1, 2), status="APPLIED",
+                ))
+        db.commit()
+        yield db
+
+
+@pytest.mark.parametrize("start_date", [None, datetime(2023, 12, 31, 5)], ids=["rollups", "raw tables"])
+def test_top_positions_value_is_bound_not_cached(db, start_date):
+    def titles(top_positions):
+        filters = KPIFilter.from_dict({"start_date": start_date, "bucket": "month", "top_positions": top_positions}, "sqlite")
+        return set(application_per_job_posting(db, filters))
+
+    # same shape each time, so the second and third calls reuse the first one's statement
+    assert titles(1) == {"a", OTHER_POSITIONS}
+    assert titles(3) == {"a", "b", "c"}
+    assert titles(2) == {"a", "b", OTHER_POSITIONS}
+
+
+def test_consolidated_statement_binds_top_positions():
+    sql = str(dashboard_kpis_stmt(KPIFilter.from_dict({"top_positions": 5})).compile(dialect=postgresql.dialect()))
+    assert "%(top_positions)s" in sql
+    assert "title_rank_1" not in sql
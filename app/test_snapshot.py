@@ -0,0 +1,49 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+
+from bulk_loader import load_file
+from check_snapshot_parity import mismatches, sample_filters
+from mock_generator import generate_dataset
+from snapshot import load_snapshot
+
+FILTERS = [
+    "everything", "departments", "positions", "whole days (rollups)", "part days (raw tables)", "open end",
+    "top positions", "all dimensions",
+]
+
+
+@pytest.fixture(scope="module")
+def db(tmp_path_factory):
+    path = tmp_path_factory.mktemp("snapshot")
+    # until a day ahead, so some applications fall in the NEW_APPLICANTS window
+    generate_dataset(str(path), users=40, positions=12, applications=300, seed=7, until=datetime.utcnow() + timedelta(days=1))
+    engine = create_engine(f"sqlite:///{path / 'snapshot.db'}")
+    SQLModel.metadata.create_all(engine)
+    for table_name in ("users", "positions", "applications", "hiring_stages"):
+        load_file(engine, table_name, os.path.join(path, f"{table_name}-0000.ndjson"))
+    with Session(engine) as db:
+        yield db
+    engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def snapshot(db):
+    # load_snapshot opens its own transaction
+    db.commit()
+    return load_snapshot(db)
+
+
+def test_sample_filters_cover_buckets_and_top_positions(db):
+    samples = sample_filters(db)
+    assert list(samples) == FILTERS
+    assert {raw.get("bucket") for raw in samples.values()} >= {"day", "week", "month"}
+    assert any(raw.get("top_positions") for raw in samples.values())
+
+
+@pytest.mark.parametrize("name", FILTERS)
+def test_snapshot_matches_sql(db, snapshot, name):
+    assert mismatches(db, snapshot, sample_filters(db)[name]) == []
+
@@ -0,0 +1,106 @@
+"""Warm-up run by each worker before it takes traffic, and the readiness flag GET /ready reports.
+
+In order: open every pool's pool_size connections, compile the raw-table KPI statements
+(the cached views below compile the rollup ones), compute the most common dashboard views
+into the KPI cache with the default view's encoded response bodies, and load the snapshot
+when it is the default backend. A failed warm-up is retried every WARMUP_RETRY_SECONDS;
+/ready stays 503 until one succeeds.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from pathlib import Path
+from loguru import logger as log
+
+from dashboard import build_dashboard_async
+from db_utils import warm_async_pool, warm_pool
+from models import DepartmentEnum
+from replicas import CONNECTION_ERRORS
+from responses import prefill_encoded
+
+load_dotenv(dotenv_path=Path(".env"))
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "10"))
+
+
+def common_filters():
+    """The views most requests ask for: the default dashboard, then each department on its own.
+    Same dicts as main.dashboard_filters builds, so they hit the same cache keys."""
+    default = {"position_id": None, "departments": None, "start_date": None, "end_date": None, "bucket": "auto", "top_positions": None}
+    return [default, *({**default, "departments": [department.value]} for department in DepartmentEnum)]
+
+
+def raw_table_filters():
+    """Matches no rows, but its date bound is off a day boundary, so every KPI takes its
+    raw-table statement rather than the rollup one."""
+    return {
+        "position_id": [0], "departments": None, "start_date": datetime.utcnow() - timedelta(days=30, seconds=1),
+        "end_date": None, "bucket": "auto", "top_positions": None,
+    }
+
+
+class Readiness:
+    def __init__(self):
+        self.ready = not WARMUP_ENABLED
+        self.attempts = 0
+        self.steps = {}
+        self.error = None
+
+    async def step(self, name: str, work):
+        started = time.perf_counter()
+        await work()
+        self.steps[name] = round(time.perf_counter() - started, 3)
+        log.info(f"Warm-up {name} took {self.steps[name]:.2f}s")
+
+    async def run(self, warm_up):
+        """Runs warm_up(self) until it succeeds, then flips ready."""
+        while not self.ready:
+            self.attempts += 1
+            try:
+                await warm_up(self)
+            except Exception as error:
+                self.error = str(error)
+                log.error(f"Warm-up failed, retrying in {WARMUP_RETRY_SECONDS:g}s: {error}")
+                await asyncio.sleep(WARMUP_RETRY_SECONDS)
+            else:
+                self.ready, self.error = True, None
+                log.success(f"Warm-up done in {sum(self.steps.values()):.2f}s, ready")
+
+    def status(self):
+        return {"ready": self.ready, "attempts": self.attempts, "steps": self.steps, "error": self.error}
+
+
+async def warm_up(readiness: Readiness, engine, read_router, snapshot_store, cached_dashboard, load_snapshot: bool):
+    """cached_dashboard(filters, target) is what GET /dashboard/ awaits, so the same cache entries get filled."""
+    async def pools():
+        await asyncio.to_thread(warm_pool, engine)
+        await warm_async_pool(read_router.primary.engine)
+        for target in read_router.replicas:
+            await read_router.check(target)
+            if read_router.usable(target):
+                try:
+                    await warm_async_pool(target.engine)
+                except CONNECTION_ERRORS as error:
+                    # a bad replica is skipped by the router, it shouldn't hold the worker back
+                    read_router.mark_down(target, error)
+
+    async def statements():
+        primary = read_router.primary
+        await build_dashboard_async(primary.session_factory, primary.dialect_name, raw_table_filters())
+
+    async def dashboards():
+        default, *others = common_filters()
+        entry = await cached_dashboard(default, read_router.choose())
+        prefill_encoded(entry["dashboard"], entry["etag"])
+        for filters in others:
+            await cached_dashboard(filters, read_router.choose())
+
+    await readiness.step("pools", pools)
+    await readiness.step("statements", statements)
+    await readiness.step("dashboards", dashboards)
+    if load_snapshot:
+        await readiness.step("snapshot", snapshot_store.get)
@@ -0,0 +1,83 @@
+"""Watermarks for /dashboard/delta/.
+
+A delta is computed from the rows whose Application.last_updated / Stage.conducted_at /
+Position.created_at is past the client's watermark. That only sees changes stamped with
+the time they were written, so everything else (deletes, bulk loads, back-dated inserts and
+updates, position edits) moves the ingest watermark forward instead, and a client whose
+watermark is older than it gets the full dashboard again.
+"""
+import os
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from pathlib import Path
+from sqlalchemy import event, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import Application, IngestWatermark, Position, Stage
+from rollups import APPLICATION_ROLLUP_FIELDS, STAGE_ROLLUP_FIELDS
+
+load_dotenv(dotenv_path=Path(".env"))
+
+# writes stamped further back than this count as back-dated; it is also how far the returned
+# watermark trails the server clock, so transactions still in flight are picked up next poll
+DELTA_WATERMARK_LAG_SECONDS = float(os.getenv("DELTA_WATERMARK_LAG_SECONDS", "30"))
+INGEST = "ingest"
+
+
+def next_watermark(replica_lag: float = 0.0) -> datetime:
+    """The watermark to hand out now; a lagging read replica pushes it further back."""
+    return datetime.utcnow() - timedelta(seconds=DELTA_WATERMARK_LAG_SECONDS + replica_lag)
+
+
+def bump_ingest_watermark(connection):
+    now = datetime.utcnow()
+    dialect_insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(IngestWatermark.__table__).values(name=INGEST, updated_at=now)
+    connection.execute(stmt.on_conflict_do_update(index_elements=["name"], set_={"updated_at": now}))
+
+
+async def get_ingest_watermark(db: AsyncSession):
+    return (await db.exec(select(IngestWatermark.updated_at).where(IngestWatermark.name == INGEST))).scalar_one_or_none()
+
+
+#----------------------Mapper events-----------------------------
+def _unstamped(target, fields, stamp: str) -> bool:
+    """True when this flush changed a KPI field of target without stamping it (stamp) with
+    a time inside the watermark lag."""
+    state = inspect(target)
+    if not any(state.attrs[field].history.has_changes() for field in fields):
+        return False
+    value = getattr(target, stamp)
+    if isinstance(value, str):  # the mock loaders hand the ORM ISO strings
+        value = datetime.fromisoformat(value)
+    return not state.attrs[stamp].history.has_changes() or value is None or value < next_watermark()
+
+
+@event.listens_for(Application, "after_insert")
+@event.listens_for(Application, "after_update")
+def _application_written(mapper, connection, target):
+    if _unstamped(target, APPLICATION_ROLLUP_FIELDS, "last_updated"):
+        bump_ingest_watermark(connection)
+
+
+@event.listens_for(Stage, "after_insert")
+@event.listens_for(Stage, "after_update")
+def _stage_written(mapper, connection, target):
+    if _unstamped(target, STAGE_ROLLUP_FIELDS, "conducted_at"):
+        bump_ingest_watermark(connection)
+
+
+@event.listens_for(Position, "after_update")
+def _position_updated(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.title.history.has_changes() or state.attrs.department.history.has_changes():
+        bump_ingest_watermark(connection)
+
+
+@event.listens_for(Application, "after_delete")
+@event.listens_for(Stage, "after_delete")
+@event.listens_for(Position, "after_delete")
+def _deleted(mapper, connection, target):
+    bump_ingest_watermark(connection)